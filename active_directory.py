@@ -93,13 +93,21 @@ from __future__ import generators
 __VERSION__ = "0.6.7"
 
 import os, sys
+import collections
+import concurrent.futures
 import datetime
+import queue
+import threading
+import time
 import win32api
 import socket
 
 from win32com.client import Dispatch, GetObject
+import pythoncom
 import win32security
 
+from directory import Record, to_int64 as convert_to_int64
+
 try:
     basestring       # python 2: no changes needed
 except NameError:
@@ -240,6 +248,56 @@ def _or (*args):
   """
   return " OR ".join (args)
 
+def _where (*args, **kwargs):
+  """Helper function to build a WHERE clause from raw clauses
+   and attribute=value pairs, all and-ed together.
+  """
+  clauses = []
+  if args:
+    clauses.append (_and (*args))
+  if kwargs:
+    clauses.append (_and (*("%s='%s'" % (k, v) for (k, v) in kwargs.items ())))
+  return _and (*clauses)
+
+def _user_filter (name):
+  """The clause find_user uses to match a user by name"""
+  return "(%s)" % _or ("sAMAccountName='%s'" % name, "displayName='%s'" % name, "cn='%s'" % name)
+
+_USER_NAME_ATTRIBUTES = ("sAMAccountName", "displayName", "cn")
+
+def _lookup (path, where_clause, attributes):
+  """Records with the given attributes for objects under path
+   which match where_clause (may be empty)
+  """
+  sql_string = []
+  sql_string.append ("SELECT %s" % ", ".join (attributes))
+  sql_string.append ("FROM '%s'" % path)
+  if where_clause:
+    sql_string.append ("WHERE %s" % where_clause)
+
+  return query_records ("\n".join (sql_string), Page_size=50)
+
+def _initialize_worker ():
+  """Make a worker thread ready for COM calls"""
+  pythoncom.CoInitializeEx (pythoncom.COINIT_MULTITHREADED)
+
+#
+# Worker threads for find_users, by max_workers, kept for the life of
+#  the process: each joins the COM apartment and opens its ADO
+#  connection once, not once per call.
+#
+_find_users_executors = {}
+_find_users_executors_lock = threading.Lock ()
+def _find_users_executor (max_workers):
+  with _find_users_executors_lock:
+    executor = _find_users_executors.get (max_workers)
+    if executor is None:
+      executor = _find_users_executors[max_workers] = concurrent.futures.ThreadPoolExecutor (
+        max_workers=max_workers, initializer=_initialize_worker,
+        thread_name_prefix="find-users"
+      )
+    return executor
+
 def _add_path (root_path, relative_path):
   """Add another level to an LDAP path.
   eg,
@@ -259,15 +317,17 @@ def _add_path (root_path, relative_path):
   return protocol + relative_path + "," + start_path
 
 #
-# Global cached ADO Connection object
+# Cached ADO Connection object, one per thread: COM objects
+#  belong to the apartment of the thread that created them.
 #
-_connection = None
+_connections = threading.local ()
 def connection ():
-  global _connection
+  _connection = getattr (_connections, "connection", None)
   if _connection is None:
     _connection = Dispatch ("ADODB.Connection")
     _connection.Provider = "ADsDSOObject"
     _connection.Open ("Active Directory Provider")
+    _connections.connection = _connection
   return _connection
 
 class ADO_record (object):
@@ -297,10 +357,7 @@ class ADO_record (object):
     s.append ("}")
     return "\n".join (s)
 
-def query (query_string, **command_properties):
-  """Auxiliary function to serve as a quick-and-dirty
-   wrapper round an ADO query
-  """
+def _execute (query_string, **command_properties):
   command = Dispatch ("ADODB.Command")
   command.ActiveConnection = connection ()
   #
@@ -317,10 +374,108 @@ def query (query_string, **command_properties):
   command.CommandText = query_string
 
   recordset, result = command.Execute ()
+  return recordset
+
+def query (query_string, **command_properties):
+  """Auxiliary function to serve as a quick-and-dirty
+   wrapper round an ADO query
+  """
+  recordset = _execute (query_string, **command_properties)
   while not recordset.EOF:
     yield ADO_record (recordset)
     recordset.MoveNext ()
 
+def query_records (query_string, **command_properties):
+  """Like query, but yields a Record of plain values per row. The
+   field index is read once per query, not once per row.
+  """
+  recordset = _execute (query_string, **command_properties)
+  if recordset.EOF:
+    return
+  fields = recordset.Fields
+  n_fields = fields.Count
+  #
+  # NB ADSI returns the fields in its own order, not necessarily
+  #  the order of the SELECT, so always go by name.
+  #
+  index = dict ((fields.Item (i).Name, i) for i in range (n_fields))
+  while not recordset.EOF:
+    yield Record (index, tuple (fields.Item (i).Value for i in range (n_fields)))
+    recordset.MoveNext ()
+
+def query_stream (query_string, page_size=500, prefetch=2, **command_properties):
+  """Like query_records, but a producer thread runs the query and
+   fetches the next page (page_size rows, in one GetRows call) while
+   the consumer is busy with the current one. At most prefetch pages
+   wait in memory. Rows are tuples over one shared field index.
+  """
+  pages = queue.Queue (maxsize=prefetch)
+  stopped = threading.Event ()
+  producer = threading.Thread (
+    target=_produce_pages,
+    args=(pages, stopped, query_string, page_size, command_properties),
+    name="ad-query-stream",
+    daemon=True
+  )
+  producer.start ()
+  try:
+    index = pages.get ()
+    if isinstance (index, BaseException):
+      raise index
+    while True:
+      page = pages.get ()
+      if page is None:
+        return
+      if isinstance (page, BaseException):
+        raise page
+      for values in page:
+        yield Record (index, values)
+  finally:
+    #
+    # If the consumer stops early, let the producer go too
+    #
+    stopped.set ()
+    while producer.is_alive ():
+      try:
+        pages.get_nowait ()
+      except queue.Empty:
+        producer.join (0.01)
+
+def _produce_pages (pages, stopped, query_string, page_size, command_properties):
+  """Producer for query_stream: puts the field index, then pages of
+   rows, then None (or an exception) on pages.
+  """
+  def put (item):
+    while not stopped.is_set ():
+      try:
+        pages.put (item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  try:
+    _initialize_worker ()
+    command_properties.setdefault ("Page_size", page_size)
+    recordset = _execute (query_string, **command_properties)
+    if recordset.EOF:
+      index = {}
+    else:
+      fields = recordset.Fields
+      index = dict ((fields.Item (i).Name, i) for i in range (fields.Count))
+    if not put (index):
+      return
+    while not recordset.EOF:
+      #
+      # GetRows returns one tuple per field; turn it round into rows
+      #
+      columns = recordset.GetRows (page_size)
+      if not put (list (zip (*columns))):
+        return
+    put (None)
+  except BaseException as error:
+    put (error)
+
 BASE_TIME = datetime.datetime (1601, 1, 1)
 def ad_time_to_datetime (ad_time):
   hi, lo = i32 (ad_time.HighPart), i32 (ad_time.LowPart)
@@ -371,6 +526,23 @@ def convert_to_flags (enum_name):
     return set (name for (bitmask, name) in enum.item_numbers () if item & bitmask)
   return _convert_to_flags
 
+#
+# Schema information by schema path, fetched once per object class
+#  and shared by all objects of that class: (properties, is_container)
+#
+_SCHEMA_CACHE = {}
+def _schema (schema_path):
+  try:
+    return _SCHEMA_CACHE[schema_path]
+  except KeyError:
+    schema = GetObject (schema_path)
+    result = (
+      tuple (schema.MandatoryProperties) + tuple (schema.OptionalProperties),
+      schema.Container
+    )
+    _SCHEMA_CACHE[schema_path] = result
+    return result
+
 class _AD_root (object):
   def __init__ (self, obj):
     _set (self, "com_object", obj)
@@ -397,19 +569,38 @@ class _AD_object (object):
     #  each other if you aren't.
     #
     _set (self, "com_object", obj)
-    schema = GetObject (obj.Schema)
-    _set (self, "properties", schema.MandatoryProperties + schema.OptionalProperties)
-    _set (self, "is_container", schema.Container)
-
-    self._property_map = dict (
-      objectGUID = convert_to_guid,
-      uSNChanged = convert_to_datetime,
-      uSNCreated = convert_to_datetime,
-      replicationSignature = convert_to_hex,
-      Parent = convert_to_object,
-      wellKnownObjects = convert_to_objects
-    )
+    properties, is_container = _schema (obj.Schema)
+    _set (self, "properties", properties)
+    _set (self, "is_container", is_container)
     self._delegate_map = dict ()
+    hot_attributes = [name for name in self.prefetch_attributes if name in properties]
+    if hot_attributes:
+      try:
+        self.prefetch (*hot_attributes)
+      except Exception:
+        #
+        # Not worth failing over: they'll be fetched one by one
+        #
+        pass
+
+  #
+  # Converters for property values, by property name. Shared by all
+  #  instances of a class; subclasses extend a copy of their base's.
+  #
+  _property_map = dict (
+    objectGUID = convert_to_guid,
+    uSNChanged = convert_to_int64,
+    uSNCreated = convert_to_int64,
+    replicationSignature = convert_to_hex,
+    Parent = convert_to_object,
+    wellKnownObjects = convert_to_objects
+  )
+
+  #
+  # Properties loaded in one round trip as soon as an object
+  #  is wrapped (see prefetch). Subclasses name their own.
+  #
+  prefetch_attributes = ()
 
   def __getitem__ (self, key):
     return getattr (self, key)
@@ -429,15 +620,42 @@ class _AD_object (object):
           attr = self.com_object.Get (name)
         except:
           raise AttributeError
-
-      converter = self._property_map.get (name)
-      if converter:
-        self._delegate_map[name] = converter (attr)
-      else:
-        self._delegate_map[name] = attr
+      self._store (name, attr)
 
     return self._delegate_map[name]
 
+  def _store (self, name, value):
+    converter = self._property_map.get (name)
+    if converter:
+      self._delegate_map[name] = converter (value)
+    else:
+      self._delegate_map[name] = value
+
+  def prefetch (self, *names):
+    """Load a number of properties in one round trip (GetInfoEx)
+     rather than one per property, so that reading them later
+     costs nothing. Properties already read are not fetched again;
+     those the object has no value for are left to be looked up
+     one by one as usual.
+
+    eg,
+
+      import active_directory
+      me = active_directory.find_user ()
+      me.prefetch ("mail", "telephoneNumber", "department")
+      print me.mail, me.telephoneNumber, me.department
+    """
+    names = [name for name in names if name not in self._delegate_map]
+    if names:
+      self.com_object.GetInfoEx (names, 0)
+      for name in names:
+        try:
+          value = self.com_object.Get (name)
+        except:
+          continue
+        self._store (name, value)
+    return self
+
   def __setitem__ (self, key, value):
     setattr (self, key, value)
 
@@ -546,7 +764,7 @@ class _AD_object (object):
 
   def find_user (self, name=None):
     name = name or win32api.GetUserName ()
-    for user in self.search ("sAMAccountName='%s' OR displayName='%s' OR cn='%s'" % (name, name, name), objectCategory='Person', objectClass='User'):
+    for user in self.search (_user_filter (name), objectCategory='Person', objectClass='User'):
       return user
 
   def find_computer (self, name=None):
@@ -570,65 +788,126 @@ class _AD_object (object):
     sql_string = []
     sql_string.append ("SELECT *")
     sql_string.append ("FROM '%s'" % self.path ())
-    clauses = []
-    if args:
-      clauses.append (_and (*args))
-    if kwargs:
-      clauses.append (_and (*("%s='%s'" % (k, v) for (k, v) in kwargs.items ())))
-    where_clause = _and (*clauses)
+    where_clause = _where (*args, **kwargs)
     if where_clause:
       sql_string.append ("WHERE %s" % where_clause)
 
     for result in query ("\n".join (sql_string), Page_size=50):
       yield AD_object (result.ADsPath.Value)
 
+  def lookup (self, *args, attributes=("ADsPath",), **kwargs):
+    """Search like search, but select only the named attributes, and
+     yield them as Records straight from the result set. No AD object
+     is fetched for the hits, so this is much cheaper when only a few
+     values are wanted.
+
+    eg,
+
+      import active_directory
+      for user in active_directory.root ().lookup (
+        objectCategory='Person', attributes=("mail", "telephoneNumber")
+      ):
+        print user.mail
+    """
+    return _lookup (self.path (), _where (*args, **kwargs), attributes)
+
+  def lookup_user (self, name=None, attributes=("ADsPath",)):
+    """Find a user as find_user does, but return only the named
+     attributes, as a Record (or None)
+    """
+    name = name or win32api.GetUserName ()
+    users = self.lookup (
+      _user_filter (name), objectCategory='Person', objectClass='User', attributes=attributes
+    )
+    for user in users:
+      return user
+
+  def find_users (self, names, attributes=("ADsPath",), chunk_size=50, max_workers=4):
+    """Find many users at once, matching names as find_user does.
+     The names go into OR-ed queries of chunk_size names each, and up
+     to max_workers queries run at the same time. Returns a dict of
+     name => Record with the named attributes, for the names found.
+
+    eg,
+
+      import active_directory
+      users = active_directory.find_users (["goldent", "jdoe"], ("mail",))
+      print users["goldent"].mail
+    """
+    names = list (names)
+    wanted = dict ((name.lower (), name) for name in names)
+    selected = tuple (attributes) + tuple (a for a in _USER_NAME_ATTRIBUTES if a not in attributes)
+    #
+    # Only plain strings go to the workers: the COM object for self
+    #  belongs to this thread's apartment.
+    #
+    path = self.path ()
+    chunks = [names[i:i + chunk_size] for i in range (0, len (names), chunk_size)]
+    wheres = [
+      _and (
+        "(%s)" % _or (*(_user_filter (name) for name in chunk)),
+        "objectCategory='Person'", "objectClass='User'"
+      )
+      for chunk in chunks
+    ]
+    found = {}
+    executor = _find_users_executor (max_workers)
+    for records in executor.map (lambda where: list (_lookup (path, where, selected)), wheres):
+      for record in records:
+        for attribute in _USER_NAME_ATTRIBUTES:
+          name = wanted.get ((record.get (attribute) or "").lower ())
+          if name is not None and name not in found:
+            found[name] = record
+    return found
+
 class _AD_user (_AD_object):
-  def __init__ (self, *args, **kwargs):
-    _AD_object.__init__ (self, *args, **kwargs)
-    self._property_map.update (dict (
-      pwdLastSet = convert_to_datetime,
-      memberOf = convert_to_objects,
-      objectSid = convert_to_sid,
-      accountExpires = convert_to_datetime,
-      badPasswordTime = convert_to_datetime,
-      lastLogoff = convert_to_datetime,
-      lastLogon = convert_to_datetime,
-      lastLogonTimestamp = convert_to_datetime,
-      lockoutTime = convert_to_datetime,
-      msExchMailboxGuid = convert_to_guid,
-      publicDelegates = convert_to_objects,
-      publicDelegatesBL = convert_to_objects,
-      sAMAccountType = convert_to_enum ("SAM_ACCOUNT_TYPES"),
-      userAccountControl = convert_to_flags ("USER_ACCOUNT_CONTROL")
-    ))
+  _property_map = dict (
+    _AD_object._property_map,
+    pwdLastSet = convert_to_datetime,
+    memberOf = convert_to_objects,
+    objectSid = convert_to_sid,
+    accountExpires = convert_to_datetime,
+    badPasswordTime = convert_to_datetime,
+    lastLogoff = convert_to_datetime,
+    lastLogon = convert_to_datetime,
+    lastLogonTimestamp = convert_to_datetime,
+    lockoutTime = convert_to_datetime,
+    msExchMailboxGuid = convert_to_guid,
+    publicDelegates = convert_to_objects,
+    publicDelegatesBL = convert_to_objects,
+    sAMAccountType = convert_to_enum ("SAM_ACCOUNT_TYPES"),
+    userAccountControl = convert_to_flags ("USER_ACCOUNT_CONTROL")
+  )
+  #
+  # What is read off a user when dialing; see configure_prefetch
+  #
+  prefetch_attributes = ("sAMAccountName", "displayName", "mail", "telephoneNumber")
 
 class _AD_computer (_AD_object):
-  def __init__ (self, *args, **kwargs):
-    _AD_object.__init__ (self, *args, **kwargs)
-    self._property_map.update (dict (
-      objectSid = convert_to_sid,
-      accountExpires = convert_to_datetime,
-      badPasswordTime = convert_to_datetime,
-      lastLogoff = convert_to_datetime,
-      lastLogon = convert_to_datetime,
-      lastLogonTimestamp = convert_to_datetime,
-      publicDelegates = convert_to_objects,
-      publicDelegatesBL = convert_to_objects,
-      pwdLastSet = convert_to_datetime,
-      sAMAccountType = convert_to_enum ("SAM_ACCOUNT_TYPES"),
-      userAccountControl = convert_to_flags ("USER_ACCOUNT_CONTROL")
-    ))
+  _property_map = dict (
+    _AD_object._property_map,
+    objectSid = convert_to_sid,
+    accountExpires = convert_to_datetime,
+    badPasswordTime = convert_to_datetime,
+    lastLogoff = convert_to_datetime,
+    lastLogon = convert_to_datetime,
+    lastLogonTimestamp = convert_to_datetime,
+    publicDelegates = convert_to_objects,
+    publicDelegatesBL = convert_to_objects,
+    pwdLastSet = convert_to_datetime,
+    sAMAccountType = convert_to_enum ("SAM_ACCOUNT_TYPES"),
+    userAccountControl = convert_to_flags ("USER_ACCOUNT_CONTROL")
+  )
 
 class _AD_group (_AD_object):
-  def __init__ (self, *args, **kwargs):
-    _AD_object.__init__ (self, *args, **kwargs)
-    self._property_map.update (dict (
-      groupType = convert_to_flags ("GROUP_TYPES"),
-      objectSid = convert_to_sid,
-      member = convert_to_objects,
-      memberOf = convert_to_objects,
-      sAMAccountType = convert_to_enum ("SAM_ACCOUNT_TYPES")
-    ))
+  _property_map = dict (
+    _AD_object._property_map,
+    groupType = convert_to_flags ("GROUP_TYPES"),
+    objectSid = convert_to_sid,
+    member = convert_to_objects,
+    memberOf = convert_to_objects,
+    sAMAccountType = convert_to_enum ("SAM_ACCOUNT_TYPES")
+  )
 
   def walk (self):
     members = self.member or []
@@ -640,34 +919,30 @@ class _AD_group (_AD_object):
         yield result
 
 class _AD_organisational_unit (_AD_object):
-  def __init__ (self, *args, **kwargs):
-    _AD_object.__init__ (self, *args, **kwargs)
-    self._property_map.update (dict (
-    ))
+  _property_map = dict (_AD_object._property_map)
 
 class _AD_domain_dns (_AD_object):
-  def __init__ (self, *args, **kwargs):
-    _AD_object.__init__ (self, *args, **kwargs)
-    self._property_map.update (dict (
-      creationTime = convert_to_datetime,
-      dSASignature = convert_to_hex,
-      forceLogoff = convert_to_datetime,
-      fSMORoleOwner = convert_to_object,
-      lockoutDuration = convert_to_datetime,
-      lockoutObservationWindow = convert_to_datetime,
-      masteredBy = convert_to_objects,
-      maxPwdAge = convert_to_datetime,
-      minPwdAge = convert_to_datetime,
-      modifiedCount = convert_to_datetime,
-      modifiedCountAtLastProm = convert_to_datetime,
-      objectSid = convert_to_sid,
-      replUpToDateVector = convert_to_hex,
-      repsFrom = convert_to_hex,
-      repsTo = convert_to_hex,
-      subRefs = convert_to_objects,
-      wellKnownObjects = convert_to_objects
-    ))
-    self._property_map['msDs-masteredBy'] = convert_to_objects
+  _property_map = dict (
+    _AD_object._property_map,
+    creationTime = convert_to_datetime,
+    dSASignature = convert_to_hex,
+    forceLogoff = convert_to_datetime,
+    fSMORoleOwner = convert_to_object,
+    lockoutDuration = convert_to_datetime,
+    lockoutObservationWindow = convert_to_datetime,
+    masteredBy = convert_to_objects,
+    maxPwdAge = convert_to_datetime,
+    minPwdAge = convert_to_datetime,
+    modifiedCount = convert_to_datetime,
+    modifiedCountAtLastProm = convert_to_datetime,
+    objectSid = convert_to_sid,
+    replUpToDateVector = convert_to_hex,
+    repsFrom = convert_to_hex,
+    repsTo = convert_to_hex,
+    subRefs = convert_to_objects,
+    wellKnownObjects = convert_to_objects
+  )
+  _property_map['msDs-masteredBy'] = convert_to_objects
 
 class _AD_public_folder (_AD_object):
   pass
@@ -680,15 +955,110 @@ _CLASS_MAP = {
   "domainDNS" : _AD_domain_dns,
   "publicFolder" : _AD_public_folder
 }
-_CACHE = {}
+class Cache (object):
+  """Bounded cache of AD objects by path. When it is full, the least
+   recently used object goes; an object also goes ttl seconds after it
+   was cached, so changes in the directory are seen eventually.
+   Counts hits, misses, evictions (for size) and expirations (for age).
+  """
+
+  def __init__ (self, max_size=1000, ttl=600):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._entries = collections.OrderedDict ()
+    self._lock = threading.Lock ()
+    self.hits = self.misses = self.evictions = self.expirations = 0
+
+  def __len__ (self):
+    return len (self._entries)
+
+  def get (self, path):
+    """Return the object cached for path, or raise KeyError"""
+    with self._lock:
+      try:
+        expires, obj = self._entries[path]
+      except KeyError:
+        self.misses += 1
+        raise
+      if time.monotonic () >= expires:
+        del self._entries[path]
+        self.expirations += 1
+        self.misses += 1
+        raise KeyError (path)
+      self._entries.move_to_end (path)
+      self.hits += 1
+      return obj
+
+  def put (self, path, obj):
+    with self._lock:
+      self._entries[path] = (time.monotonic () + self.ttl, obj)
+      self._entries.move_to_end (path)
+      while len (self._entries) > self.max_size:
+        self._entries.popitem (last=False)
+        self.evictions += 1
+
+  def invalidate (self, path):
+    """Forget the object cached for path, if any"""
+    with self._lock:
+      self._entries.pop (path, None)
+
+  def clear (self):
+    with self._lock:
+      self._entries.clear ()
+
+  def stats (self):
+    with self._lock:
+      return dict (
+        size = len (self._entries),
+        hits = self.hits,
+        misses = self.misses,
+        evictions = self.evictions,
+        expirations = self.expirations
+      )
+
+_CACHE = Cache ()
 def cached_AD_object (path, obj):
   try:
-    return _CACHE[path]
+    return _CACHE.get (path)
   except KeyError:
     classed_obj = _CLASS_MAP.get (obj.Class, _AD_object) (obj)
-    _CACHE[path] = classed_obj
+    _CACHE.put (path, classed_obj)
     return classed_obj
 
+def configure_cache (max_size=None, ttl=None):
+  """Change the size limit and/or time-to-live (in seconds) of the
+   AD object cache. Objects already cached keep their expiry time.
+  """
+  if max_size is not None:
+    _CACHE.max_size = max_size
+  if ttl is not None:
+    _CACHE.ttl = ttl
+
+def configure_prefetch (*names):
+  """Change the properties loaded in one round trip whenever a
+   user object is wrapped. With no names, none are prefetched and
+   each property is fetched when it is first read.
+
+  eg,
+
+    import active_directory
+    active_directory.configure_prefetch ("mail", "telephoneNumber", "manager")
+  """
+  _AD_user.prefetch_attributes = names
+
+def invalidate (path=None):
+  """Forget the cached AD object for path, or all of them. The
+   path is as given to AD_object, with LDAP:// in front.
+  """
+  if path is None:
+    _CACHE.clear ()
+  else:
+    _CACHE.invalidate (path)
+
+def cache_stats ():
+  """Return the AD object cache's size and hit/miss/eviction counts"""
+  return _CACHE.stats ()
+
 def AD_object (obj_or_path=None, path=""):
   """Factory function for suitably-classed Active Directory
   objects from an incoming path or object. NB The interface
@@ -719,7 +1089,17 @@ def AD_object (obj_or_path=None, path=""):
 
 def AD (server=None):
   default_naming_context = _root (server).Get ("defaultNamingContext")
-  return AD_object (GetObject ("LDAP://%s" % default_naming_context))
+  if server:
+    return AD_object (GetObject ("LDAP://%s/%s" % (server, default_naming_context)))
+  else:
+    return AD_object (GetObject ("LDAP://%s" % default_naming_context))
+
+def domain_controller ():
+  """Return the DNS name of the domain controller a serverless
+   bind currently goes to. Update sequence numbers (uSNChanged)
+   only make sense per domain controller.
+  """
+  return _root ().Get ("dnsHostName")
 
 def _root (server=None):
   if server:
@@ -730,6 +1110,12 @@ def _root (server=None):
 def find_user (name=None):
   return root ().find_user (name)
 
+def lookup_user (name=None, attributes=("ADsPath",)):
+  return root ().lookup_user (name, attributes)
+
+def find_users (names, attributes=("ADsPath",), chunk_size=50, max_workers=4):
+  return root ().find_users (names, attributes, chunk_size, max_workers)
+
 def find_computer (name=None):
   return root ().find_computer (name)
 
@@ -756,11 +1142,19 @@ def root ():
 def search (*args, **kwargs):
   return root ().search (*args, **kwargs)
 
-def search_ex (query_string=""):
+def lookup (*args, attributes=("ADsPath",), **kwargs):
+  return root ().lookup (*args, attributes=attributes, **kwargs)
+
+def search_ex (query_string="", stream=False):
   """Search the Active Directory by specifying a complete
    query string. NB The results will *not* be AD_objects
    but rather ADO_objects which are queried for their fields.
 
+   With stream=True, the rows are fetched a page ahead in the
+   background and are Records of plain values (user.displayName,
+   not user.displayName.Value), which is much faster and smaller
+   for large exports.
+
    eg,
 
      import active_directory
@@ -771,5 +1165,9 @@ def search_ex (query_string=""):
      \"""):
        print user.displayName
   """
+  if stream:
+    for result in query_stream (query_string):
+      yield result
+    return
   for result in query (query_string, Page_size=50):
     yield result
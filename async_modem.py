@@ -0,0 +1,181 @@
+"""
+A modem emulator driven by asyncio
+
+ - same commands and states as modem.Modem, but instead of blocking a thread
+   in serial_port.read(), the modem is woken by the event loop when data
+   arrives, so one loop can serve many ports, timers and dial tasks
+"""
+import asyncio
+import concurrent.futures
+import io
+import logging
+import os
+import time
+
+import serial
+
+from modem import Modem, DummyDialer
+
+# the modem.DIAL_RESULTS an AsyncModem supports: dialing inline would stall
+# the event loop
+DIAL_RESULTS = ('immediate', 'deferred')
+
+
+class AsyncModem(Modem):
+    """Simulates a modem, run by an asyncio event loop"""
+    def __init__(self, serial_port, dialer, name=None, dial_result='deferred', dial_pool=None,
+                 trace=None):
+        # pylint: disable=too-many-arguments
+        if dial_result not in DIAL_RESULTS:
+            raise ValueError(f'AsyncModem: dial_result must be one of {DIAL_RESULTS}')
+        super().__init__(serial_port, dialer, name, dial_result, dial_pool, trace)
+        self._loop = None
+        self._reader = None
+        self._timer = None  # asyncio.TimerHandle for the escape deadline
+        self._fd = None     # file descriptor watched by the event loop
+
+
+    def _fileno(self):
+        # a pollable file descriptor for the serial port, or None
+        try:
+            return self._serial_port.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+
+
+    async def run(self):
+        """runs the modem until cancelled"""
+        loop = self._loop = asyncio.get_running_loop()
+        fd = self._fileno()
+        if fd is not None:
+            stopped = loop.create_future()
+            try:
+                loop.add_reader(fd, self._on_readable, stopped)
+            except NotImplementedError:
+                # e.g. the proactor event loop on Windows
+                pass
+            else:
+                self._fd = fd
+                try:
+                    self._serial_port.timeout = 0
+                    await stopped
+                finally:
+                    self._fd = None
+                    loop.remove_reader(fd)
+                return
+        await self._run_reader_thread(loop)
+
+
+    def _on_readable(self, stopped):
+        try:
+            self._read_serial()
+            self._flush_output()
+        except Exception as exc: # pylint: disable=broad-except
+            if not stopped.done():
+                stopped.set_exception(exc)
+
+
+    async def _run_reader_thread(self, loop):
+        # Ports without a pollable file descriptor (COM ports on Windows) are
+        # read by blocking in a thread of their own. Everything else still
+        # happens in the event loop.
+        self._serial_port.timeout = None
+        self._reader = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='modem-reader')
+        try:
+            while True:
+                buf = await loop.run_in_executor(self._reader, self._read_blocking)
+                now = time.monotonic()
+                self._received(buf, len(buf), now)
+                self._receive(buf, now)
+                self._flush_output()
+        finally:
+            # unblock a read still in progress, so the thread can finish
+            cancel_read = getattr(self._serial_port, 'cancel_read', None)
+            if cancel_read is not None:
+                cancel_read()
+            self._reader.shutdown(wait=False)
+            self._reader = None
+
+
+    def _readinto(self):
+        # The event loop says there is data, so read straight from the file
+        # descriptor into the buffer: as much as there is, without a copy
+        if self._fd is None:
+            return super()._readinto()
+        try:
+            length = os.readv(self._fd, [self._read_buffer])
+        except BlockingIOError:
+            return 0
+        if length == 0:
+            # readable, but nothing to read: the other end has hung up, which
+            # pyserial reports the same way
+            raise serial.SerialException('device reports readiness to read but returned no '
+                                         'data (device disconnected or multiple access on port?)')
+        return length
+
+
+    def _read_blocking(self):
+        return self._serial_port.read(self._serial_port.in_waiting or 1)
+
+
+    def _deadlines_changed(self):
+        # the event loop wakes the modem when the escape deadline is due,
+        # whether or not more data arrives
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._escape_deadline is not None and self._loop is not None:
+            self._timer = self._loop.call_at(self._escape_deadline, self._on_deadline)
+
+
+    def _on_deadline(self):
+        self._timer = None
+        self._check_deadlines(time.monotonic())
+        self._flush_output()
+        if self._escape_deadline is not None:
+            # the loop may run a timer a clock tick early
+            self._deadlines_changed()
+
+
+    def _dial_started(self, dial):
+        # the dial finishes in a thread of the dial pool, the result is
+        # written from the event loop
+        dial.add_done_callback(
+            lambda dial: self._loop.call_soon_threadsafe(self._on_dial_done))
+
+
+    def _on_dial_done(self):
+        self._finish_dial()
+        self._flush_output()
+
+
+async def _run_modem(the_modem):
+    # a modem that fails (its port is unplugged, say) is logged and stops,
+    # as it did in a service of its own; the others keep going
+    try:
+        await the_modem.run()
+    except Exception: # pylint: disable=broad-except
+        logging.getLogger('modem').exception('modem on %s failed, stopped it', the_modem.name)
+
+
+async def run_modems(modems):
+    """runs all `modems` in the current event loop, until all of them have
+    stopped; one that fails is logged and stops, the others keep running"""
+    await asyncio.gather(*(_run_modem(the_modem) for the_modem in modems))
+
+
+if __name__ == "__main__":
+
+    from init_serial import init_serial
+
+    def runmodem():
+        """creates a dummy modem for running tests"""
+        serial_port = init_serial()
+        dialer = DummyDialer()
+        modem = AsyncModem(serial_port, dialer)
+
+        asyncio.run(modem.run())
+
+
+    runmodem()
@@ -0,0 +1,369 @@
+"""benchmarks for active_directory against a fake COM layer (run: python bench_active_directory.py)
+
+The fake stands in for win32com, win32api and win32security, serves a
+generated directory, and counts the round trips active_directory makes.
+Every round trip takes LATENCY seconds, roughly like a nearby domain controller.
+"""
+import collections
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+LATENCY = 0.0002
+ROUND_TRIPS = collections.Counter()
+
+
+def _round_trip(kind):
+    ROUND_TRIPS[kind] += 1
+    if LATENCY:
+        time.sleep(LATENCY)
+
+
+def _make_users(count):
+    return [{'ADsPath': f'LDAP://CN=user{i},CN=Users,DC=example,DC=com',
+             'Class': 'user',
+             'Schema': 'LDAP://schema/user',
+             'sAMAccountName': f'user{i}',
+             'displayName': f'User {i}',
+             'cn': f'user{i}',
+             'mail': f'user{i}@example.com',
+             'telephoneNumber': f'22 33 {i:04d}',
+             'uSNChanged': 1000 + i}
+            for i in range(count)]
+
+
+DIRECTORY = {}
+SCHEMAS = {
+    'LDAP://schema/user': (('cn', 'objectClass'), ('mail', 'telephoneNumber', 'displayName',
+                                                   'sAMAccountName')),
+    'LDAP://schema/domainDNS': (('dc',), ()),
+}
+
+
+def populate(count):
+    """fills the fake directory with `count` users"""
+    DIRECTORY.clear()
+    DIRECTORY['LDAP://DC=example,DC=com'] = {'ADsPath': 'LDAP://DC=example,DC=com',
+                                             'Class': 'domainDNS',
+                                             'Schema': 'LDAP://schema/domainDNS'}
+    for user in _make_users(count):
+        DIRECTORY[user['ADsPath']] = user
+
+
+class _FakeADsObject:
+    """an IADs object: a few properties direct, all of them through Get"""
+    def __init__(self, entry):
+        self._entry = entry
+        self.ADsPath = entry['ADsPath']
+        self.Class = entry['Class']
+        self.Schema = entry['Schema']
+        self._loaded = set()
+
+    def GetInfoEx(self, names, flags): # pylint: disable=invalid-name
+        """load a number of properties into the property cache"""
+        # pylint: disable=unused-argument
+        _round_trip('GetInfoEx')
+        self._loaded.update(names)
+
+    def Get(self, name): # pylint: disable=invalid-name
+        """fetch one property, unless it is in the property cache already"""
+        if name not in self._loaded:
+            _round_trip('Get')
+        try:
+            return self._entry[name]
+        except KeyError as exc:
+            raise Exception(f'no property {name}') from exc # pylint: disable=broad-exception-raised
+
+
+class _FakeSchema: # pylint: disable=too-few-public-methods
+    def __init__(self, mandatory, optional):
+        self.MandatoryProperties = mandatory # pylint: disable=invalid-name
+        self.OptionalProperties = optional # pylint: disable=invalid-name
+        self.Container = False # pylint: disable=invalid-name
+
+
+class _FakeRootDSE: # pylint: disable=too-few-public-methods
+    def Get(self, name): # pylint: disable=invalid-name,no-self-use
+        """defaultNamingContext or dnsHostName"""
+        return {'defaultNamingContext': 'DC=example,DC=com',
+                'dnsHostName': 'dc1.example.com'}[name]
+
+
+def _get_object(path):
+    _round_trip('GetObject')
+    path = _SERVER.sub('LDAP://', path)
+    if path.endswith('rootDSE'):
+        return _FakeRootDSE()
+    if path in SCHEMAS:
+        return _FakeSchema(*SCHEMAS[path])
+    return _FakeADsObject(DIRECTORY[path])
+
+
+class _FakeField: # pylint: disable=too-few-public-methods
+    def __init__(self, name, value):
+        self.Name = name # pylint: disable=invalid-name
+        self.Value = value # pylint: disable=invalid-name
+
+
+class _FakeFields:
+    def __init__(self, recordset):
+        self._recordset = recordset
+
+    @property
+    def Count(self): # pylint: disable=invalid-name
+        """number of columns"""
+        return len(self._recordset.columns)
+
+    def Item(self, i): # pylint: disable=invalid-name
+        """column i of the current row"""
+        name = self._recordset.columns[i]
+        return _FakeField(name, self._recordset.rows[self._recordset.position].get(name))
+
+
+class _FakeRecordset:
+    def __init__(self, columns, rows, page_size):
+        self.columns = columns
+        self.rows = rows
+        self.position = 0
+        self._page_size = page_size
+        self.Fields = _FakeFields(self) # pylint: disable=invalid-name
+
+    @property
+    def EOF(self): # pylint: disable=invalid-name
+        """past the last row"""
+        return self.position >= len(self.rows)
+
+    def MoveNext(self): # pylint: disable=invalid-name
+        """next row, fetching the next page from the server when needed"""
+        self.position += 1
+        if self.position % self._page_size == 0 and not self.EOF:
+            _round_trip('page')
+
+    def GetRows(self, rows): # pylint: disable=invalid-name
+        """up to `rows` rows from the current one on, as one tuple per column"""
+        page = self.rows[self.position:self.position + rows]
+        self.position += len(page)
+        if not self.EOF:
+            _round_trip('page')
+        return tuple(tuple(row.get(name) for row in page) for name in self.columns)
+
+
+_SERVER = re.compile(r'^LDAP://[^/=]+/(?=[^/]*=)')
+_CONDITION = re.compile(r"(\w+)\s*=\s*'([^']*)'")
+_USN_CONDITION = re.compile(r"uSNChanged\s*>=\s*(\d+)")
+
+
+class _FakeCommand:
+    def __init__(self):
+        self.ActiveConnection = None # pylint: disable=invalid-name
+        self.CommandText = '' # pylint: disable=invalid-name
+        self._properties = {}
+
+    def Properties(self, name): # pylint: disable=invalid-name
+        """a settable command property"""
+        return self._properties.setdefault(name, types.SimpleNamespace(Value=None))
+
+    def Execute(self): # pylint: disable=invalid-name
+        """runs the query: only ORs of equality conditions on the object's
+        own names and uSNChanged>= are understood, everything else matches anything"""
+        _round_trip('Execute')
+        select = re.match(r"SELECT (.*)\n", self.CommandText).group(1)
+        where = self.CommandText.partition('WHERE')[2]
+        names = [condition for condition in _CONDITION.findall(where)
+                 if condition[0] in ('sAMAccountName', 'displayName', 'cn')]
+        usn = _USN_CONDITION.search(where)
+        usn = int(usn.group(1)) if usn else 0
+        rows = [entry for entry in DIRECTORY.values() if entry['Class'] == 'user' and
+                (not names or any(entry.get(key) == value for key, value in names)) and
+                entry['uSNChanged'] >= usn]
+        if select.strip() == '*':
+            columns = ['ADsPath', 'cn', 'mail', 'telephoneNumber', 'sAMAccountName']
+        else:
+            # ADSI returns the columns in reverse order
+            columns = [name.strip() for name in select.split(',')][::-1]
+        page_size = self._properties.get('Page size', types.SimpleNamespace(Value=None)).Value
+        return _FakeRecordset(columns, rows, page_size or 1000), None
+
+
+def _dispatch(name):
+    if name == 'ADODB.Command':
+        return _FakeCommand()
+    return types.SimpleNamespace(Provider=None, Open=lambda *args: _round_trip('Open'))
+
+
+def install():
+    """makes `import active_directory` use the fake COM layer"""
+    client = types.ModuleType('win32com.client')
+    client.Dispatch = _dispatch
+    client.GetObject = _get_object
+    win32com = types.ModuleType('win32com')
+    win32com.client = client
+    win32api = types.ModuleType('win32api')
+    win32api.GetUserName = lambda: 'user0'
+    win32security = types.ModuleType('win32security')
+    win32security.SID = bytes
+    pythoncom = types.ModuleType('pythoncom')
+    pythoncom.COINIT_MULTITHREADED = 0
+    pythoncom.CoInitializeEx = lambda flags: None
+    sys.modules.update({'win32com': win32com, 'win32com.client': client,
+                        'win32api': win32api, 'win32security': win32security,
+                        'pythoncom': pythoncom})
+
+
+def bench_search_page(ad, count=50):
+    """round trips and time for wrapping one page of search results,
+    with the schema fetched per object (as before) and per class"""
+    # pylint: disable=protected-access
+    populate(count)
+    results = {}
+    for name, per_object in [('schema per object', True), ('schema per class', False)]:
+        ad._CACHE.clear()
+        ad._SCHEMA_CACHE.clear()
+        ad._ad = None
+        ad.root()
+        ROUND_TRIPS.clear()
+        start = time.perf_counter()
+        for _ in ad.search(objectCategory='Person'):
+            if per_object:
+                ad._SCHEMA_CACHE.clear()
+        results[name] = (time.perf_counter() - start, dict(ROUND_TRIPS))
+    return results
+
+
+def bench_repeat_dials(ad, users=200, dials=1000, max_size=50):
+    """cache statistics for find_user over a skewed mix of repeat dialers"""
+    populate(users)
+    rng = random.Random(1)
+    ad.invalidate()
+    ad.configure_cache(max_size=max_size)
+    before = ad.cache_stats()
+    start = time.perf_counter()
+    for _ in range(dials):
+        # a few operators dial most of the time
+        ad.find_user(f'user{int(users * rng.random() ** 3)}')
+    seconds = time.perf_counter() - start
+    after = ad.cache_stats()
+    return seconds, {key: after[key] - before[key] if key != 'size' else after[key]
+                     for key in after}
+
+
+def bench_prefetch(ad, users=200):
+    """round trips and time to read the dialing attributes of every user,
+    one property at a time and prefetched when the user is wrapped"""
+    populate(users)
+    results = {}
+    hot_attributes = ad._AD_user.prefetch_attributes # pylint: disable=protected-access
+    try:
+        for label, prefetch in [('one by one', ()), ('prefetched', hot_attributes)]:
+            ad.configure_prefetch(*prefetch)
+            ad.invalidate()
+            ROUND_TRIPS.clear()
+            start = time.perf_counter()
+            for i in range(users):
+                user = ad.find_user(f'user{i}')
+                assert (user.sAMAccountName, user.displayName, user.mail,
+                        user.telephoneNumber)[0] == f'user{i}'
+            results[label] = (time.perf_counter() - start, dict(ROUND_TRIPS))
+    finally:
+        ad.configure_prefetch(*hot_attributes)
+    return results
+
+
+def bench_find_users(ad, users=2000, names=200):
+    """round trips and time to resolve many names one by one and in bulk
+    (twice, as the connections of the find_users workers are kept)"""
+    populate(users)
+    wanted = [f'user{i * (users // names)}' for i in range(names)]
+    results = {}
+    for label, resolve in [
+            ('one by one', lambda: {name: ad.lookup_user(name, ('mail',)) for name in wanted}),
+            ('find_users', lambda: ad.find_users(wanted, ('mail',))),
+            ('find_users again', lambda: ad.find_users(wanted, ('mail',)))]:
+        ROUND_TRIPS.clear()
+        start = time.perf_counter()
+        found = resolve()
+        assert len(found) == names
+        results[label] = (time.perf_counter() - start, dict(ROUND_TRIPS))
+    return results
+
+
+def bench_export(ad, users=20000, work=0.00002):
+    """time and peak memory for a search_ex export of all users, one row
+    at a time (query) and streamed a page ahead (query_stream); every row
+    costs the consumer `work` seconds, like writing it out somewhere"""
+    populate(users)
+    query_string = ("SELECT sAMAccountName, mail, telephoneNumber\n"
+                    "FROM 'LDAP://DC=example,DC=com'\nWHERE objectCategory='Person'")
+    results = {}
+    for label, stream, read in [
+            ('query', False, lambda row: (row.sAMAccountName.Value, row.mail.Value)),
+            ('query_stream', True, lambda row: (row.sAMAccountName, row.mail))]:
+        ROUND_TRIPS.clear()
+        tracemalloc.start()
+        start = time.perf_counter()
+        rows = []
+        for row in ad.search_ex(query_string, stream=stream):
+            rows.append(row)
+            read(row)
+            if work:
+                time.sleep(work)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert len(rows) == users
+        results[label] = (seconds, peak, dict(ROUND_TRIPS))
+    return results
+
+
+def bench_directory_index(users=2000, changed=10, lookups=10000):
+    """round trips for a full and an incremental sync of a DirectoryIndex,
+    and the time for lookups in it"""
+    import directory_index # pylint: disable=import-outside-toplevel
+    populate(users)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'index.json.gz')
+        index = directory_index.DirectoryIndex(path, '+47')
+        for name, count in [('full sync', users), ('incremental sync', changed)]:
+            for entry in list(DIRECTORY.values())[-count:]:
+                if 'uSNChanged' in entry:
+                    entry['uSNChanged'] += users
+            ROUND_TRIPS.clear()
+            start = time.perf_counter()
+            index.sync()
+            results[name] = (time.perf_counter() - start, dict(ROUND_TRIPS))
+        startup = time.perf_counter()
+        directory_index.DirectoryIndex(path)
+        results['load at startup'] = (time.perf_counter() - startup, {})
+        start = time.perf_counter()
+        for i in range(lookups):
+            index.identity(f'user{i % users}')
+        results[f'{lookups} lookups'] = (time.perf_counter() - start, {})
+    return results
+
+
+if __name__ == "__main__":
+    install()
+    import active_directory # pylint: disable=wrong-import-position
+
+    for label, (seconds, round_trips) in bench_search_page(active_directory).items():
+        print(f"search, 50 hits ({label}): {seconds * 1000:.1f} ms, round trips {round_trips}")
+    seconds, stats = bench_repeat_dials(active_directory)
+    print(f"find_user, 1000 dials by 200 users: {seconds * 1000:.1f} ms, cache {stats}")
+    for label, (seconds, round_trips) in bench_prefetch(active_directory).items():
+        print(f"read 4 attributes of 200 users ({label}): {seconds * 1000:.1f} ms,"
+              f" round trips {round_trips}")
+    for label, (seconds, round_trips) in bench_find_users(active_directory).items():
+        print(f"resolve 200 of 2000 users ({label}): {seconds * 1000:.1f} ms,"
+              f" round trips {round_trips}")
+    for label, (seconds, peak, round_trips) in bench_export(active_directory).items():
+        print(f"export 20000 users ({label}): {seconds * 1000:.1f} ms,"
+              f" peak {peak / 1e6:.1f} MB, round trips {round_trips}")
+    for label, (seconds, round_trips) in bench_directory_index().items():
+        print(f"directory index of 2000 users ({label}): {seconds * 1000:.1f} ms,"
+              f" round trips {round_trips}")
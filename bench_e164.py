@@ -0,0 +1,75 @@
+"""benchmarks for e164 (run: python bench_e164.py)"""
+import random
+import time
+
+import e164
+
+
+def _numbers(count, seed=1):
+    rng = random.Random(seed)
+    formats = ['{} {} {}', '+47 {} {} {}', '0047{}{}{}', '{}-{}-{}', '({}) {} {}']
+    return [rng.choice(formats).format(rng.randint(10, 99), rng.randint(10, 99),
+                                       rng.randint(1000, 9999))
+            for _ in range(count)]
+
+
+def _legacy_to_e164(number, country_code='', local_code=''):
+    # e164.to_e164 as it was: uncompiled patterns, nothing remembered,
+    # no numbering plans
+    # pylint: disable=too-many-return-statements
+    import re # pylint: disable=import-outside-toplevel
+    number = str(number)
+    country_code = str(country_code)
+    local_code = str(local_code)
+    digits = re.sub(r'\D', '', number)
+    if re.match(r'^\+', number):
+        return f"+{digits}"
+    if re.match(r'^00', number):
+        return f"+{digits[2:]}"
+    if re.match(r'^\+', country_code):
+        country_code = country_code[1:]
+    if re.match(r'^00', country_code):
+        country_code = country_code[2:]
+    if re.match(r'^0', number):
+        return f"+{country_code}{digits[1:]}"
+    if re.match(r'^0', local_code):
+        local_code = local_code[1:]
+    return f"+{country_code}{local_code}{digits}"
+
+
+def bench_dials(dials=100000, operators=20):
+    """numbers per second for the two conversions on every dial: the
+    operator's own number (few distinct) and the destination"""
+    fallbacks = _numbers(operators, seed=2)
+    destinations = _numbers(dials // 10)
+    results = {}
+    for label, convert in [('legacy', _legacy_to_e164), ('to_e164', e164.to_e164)]:
+        start = time.perf_counter()
+        for i in range(dials):
+            convert(fallbacks[i % operators], '+47')
+            convert(destinations[i % len(destinations)], '+47')
+        results[label] = 2 * dials / (time.perf_counter() - start)
+    return results
+
+
+def bench_export(count=100000):
+    """numbers per second when normalizing a directory export of distinct numbers"""
+    numbers = _numbers(count, seed=3)
+    results = {}
+    for label, convert in [
+            ('legacy', lambda: [_legacy_to_e164(number, '+47') for number in numbers]),
+            ('to_e164', lambda: [e164.to_e164(number, '+47') for number in numbers]),
+            ('to_e164_many', lambda: e164.to_e164_many(numbers, '+47'))]:
+        e164._to_e164.cache_clear() # pylint: disable=protected-access
+        start = time.perf_counter()
+        converted = convert()
+        results[label] = count / (time.perf_counter() - start)
+        assert None not in converted
+    return results
+
+
+if __name__ == "__main__":
+    for label, rate in bench_dials().items():
+        print(f"dials ({label}): {rate:,.0f} numbers/s")
+    for label, rate in bench_export().items():
+        print(f"export of 100000 numbers ({label}): {rate:,.0f} numbers/s")
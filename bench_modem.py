@@ -0,0 +1,217 @@
+"""microbenchmarks for the modem emulator (run: python bench_modem.py)"""
+import os
+import re
+import time
+import timeit
+
+import modem
+from testmodem import QuietDialer
+
+
+class _NullSerial:
+    """Stands in for a serial port, throws away everything written"""
+    def __init__(self):
+        self.timeout = None
+        self.in_waiting = 0
+
+    def read(self, size=1): # pylint: disable=unused-argument,no-self-use
+        """never any data"""
+        return b''
+
+    def write(self, data): # pylint: disable=no-self-use
+        """discard data"""
+        return len(data)
+
+
+class _CountingSerial(_NullSerial):
+    """Stands in for a serial port, counts the writes"""
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, data):
+        """count and discard data"""
+        self.writes += 1
+        return len(data)
+
+
+def _legacy_receive_online(self, buf, now):
+    # ONLINE state handling of received data as it was before the fast path
+    # pylint: disable=protected-access
+    if self._escape_chars_read == 3:
+        if buf != b'':
+            self._escape_chars_read = 0
+            self._last_data_read = now
+    elif self._escape_chars_read > 0:
+        if (self._escape_chars_read == 1 and buf in [self.escape, self.escape * 2] or
+                self._escape_chars_read == 2 and buf == self.escape):
+            self._escape_chars_read += len(buf)
+            self._last_data_read = now
+        elif buf != b'':
+            self._escape_chars_read = 0
+            self._last_data_read = now
+    elif (now - self._last_data_read > self.escape_wait and
+          buf in [self.escape, self.escape * 2, self.escape * 3]):
+        self._escape_chars_read = len(buf)
+        self._last_data_read = now
+    elif buf != b'':
+        self._last_data_read = now
+
+
+def _legacy_process_at_commands(self, line):
+    # The dispatcher as it was before commands were compiled into a single
+    # pattern: one uncompiled regex per entry in _commands, per token.
+    # pylint: disable=protected-access
+    legacy_commands = {re.escape(name): func for name, func in modem.Modem._commands.items()}
+    result = modem._ModemResult.OK
+    while line != b'' and result == modem._ModemResult.OK:
+        break_out = False
+        for cmd_name, cmd_func in legacy_commands.items():
+            if matches := re.match(cmd_name + b'(\\d*)(.*)$', line):
+                break_out = True
+                param = modem._int0(matches.group(1))
+                line = matches.group(2)
+                try:
+                    result = cmd_func(self, param)
+                except (ValueError, NotImplementedError):
+                    result = modem._ModemResult.ERROR
+                break
+        if break_out:
+            continue
+        if matches := re.match(b'D[PT]?(\\s*\\+?[\\d\\s]+)\\;?$', line):
+            line = b''
+            self._dialer.dial(re.sub(b'\\s', b'', matches.group(1)).decode('ascii'))
+        else:
+            result = modem._ModemResult.ERROR
+            break
+    self._write_command_result(result)
+
+
+_COMMAND_LINES = [
+    b'E0V1Q0X4S0=0S7=60L0M0',
+    b'Z',
+    b'S2=43S3=13S4=10S5=8',
+    b'DT 555 1234',
+    b'E1Q0V1X4',
+]
+
+
+def _commands_per_line():
+    # pylint: disable=protected-access
+    count = sum(len(modem.Modem._command_token.findall(line)) for line in _COMMAND_LINES)
+    return count / len(_COMMAND_LINES)
+
+
+def bench_at_commands(number=20000):
+    """commands/sec for the legacy dispatcher and the compiled one"""
+    # pylint: disable=protected-access
+    the_modem = modem.Modem(_NullSerial(), QuietDialer())
+    the_modem._response_log = lambda *args: None
+    per_line = _commands_per_line()
+
+    def legacy():
+        for line in _COMMAND_LINES:
+            _legacy_process_at_commands(the_modem, line)
+
+    def compiled():
+        for line in _COMMAND_LINES:
+            the_modem._process_at_commands(line)
+
+    results = {}
+    for name, func in [('legacy', legacy), ('compiled', compiled)]:
+        seconds = min(timeit.repeat(func, number=number // len(_COMMAND_LINES), repeat=3))
+        results[name] = per_line * number / seconds
+    return results
+
+
+def bench_line_discipline(size=1 << 16):
+    """bytes/sec through the command line editor, pasted and typed"""
+    # pylint: disable=protected-access
+    the_modem = modem.Modem(_NullSerial(), QuietDialer())
+    the_modem._command_log = the_modem._response_log = lambda *args: None
+    line = b'ATE0V1Q0X4S0=0S7=60L0M0\b0\r'
+    pasted = line * (size // len(line))
+    typed = [pasted[i:i + 1] for i in range(len(pasted))]
+
+    def paste():
+        the_modem._edit_command_line(pasted)
+
+    def type_slowly():
+        for byte in typed:
+            the_modem._edit_command_line(byte)
+
+    results = {}
+    for name, func in [('pasted', paste), ('typed', type_slowly)]:
+        seconds = min(timeit.repeat(func, number=1, repeat=3))
+        results[name] = len(pasted) / seconds
+    return results
+
+
+def bench_command_output(number=20000):
+    """command lines/sec and serial port writes per line, for lines typed
+    with echo on, written at once as each line ends"""
+    # pylint: disable=protected-access
+    port = _CountingSerial()
+    the_modem = modem.Modem(port, QuietDialer())
+    the_modem._command_log = the_modem._response_log = lambda *args: None
+    lines = [b'AT' + line + b'\r' for line in _COMMAND_LINES if not line.startswith(b'D')]
+    lines.append(b'ATS2?\r')
+
+    def type_lines():
+        for line in lines:
+            the_modem._receive(line, 0.0)
+            the_modem._flush_output()
+
+    seconds = min(timeit.repeat(type_lines, number=number // len(lines), repeat=3))
+    port.writes = 0
+    type_lines()
+    return len(lines) * (number // len(lines)) / seconds, port.writes / len(lines)
+
+
+def bench_online_data(chunks=(64, 1024), number=20000):
+    """bytes/sec for data received in ONLINE state through a pty, for reads
+    of each size in `chunks`: read with pyserial and handled as before, and
+    by the fast path of an AsyncModem (POSIX only)"""
+    # pylint: disable=protected-access,import-outside-toplevel
+    import tty
+    import serial
+    import async_modem
+
+    results = {}
+    for chunk in chunks:
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        port = serial.Serial(os.ttyname(slave), timeout=0)
+        the_modem = async_modem.AsyncModem(port, QuietDialer())
+        the_modem._state = modem._ModemState.ONLINE
+        the_modem._fd = port.fileno()
+        data = b'x' * chunk
+
+        def legacy(the_modem=the_modem, port=port, master=master, data=data):
+            os.write(master, data)
+            buf = port.read(port.in_waiting or 1)
+            _legacy_receive_online(the_modem, buf, time.monotonic())
+
+        def fast(the_modem=the_modem, master=master, data=data):
+            os.write(master, data)
+            the_modem._read_serial()
+
+        for name, func in [('read', legacy), ('readinto', fast)]:
+            elapsed = min(timeit.repeat(func, number=number, repeat=3))
+            results[f'{chunk} byte reads, {name}'] = chunk * number / elapsed
+        port.close()
+        os.close(master)
+    return results
+
+
+if __name__ == "__main__":
+    for name, rate in bench_at_commands().items():
+        print(f"AT dispatcher ({name}): {rate:,.0f} commands/sec")
+    for name, rate in bench_line_discipline().items():
+        print(f"Line discipline ({name}): {rate:,.0f} bytes/sec")
+    rate, writes = bench_command_output()
+    print(f"Command lines with echo: {rate:,.0f} lines/sec, {writes:.1f} writes/line")
+    if hasattr(os, 'openpty'):
+        for name, rate in bench_online_data().items():
+            print(f"Online data ({name}): {rate:,.0f} bytes/sec")
@@ -0,0 +1,129 @@
+"""benchmarks for PhoneLogDialer against a local Phonelog stand-in
+(run: python bench_phonelog.py)
+
+The dialer runs as in main.py, with the fake COM layer of
+bench_active_directory for its directory lookups and a fixed console user.
+For each fault profile and number of dialing threads, it reports dials/sec,
+latency percentiles and the errors the dialer raised. With openssl on the
+path, the profiles without faults are also run over HTTPS.
+"""
+import collections
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import bench_active_directory
+from phonelog_standin import Faults, PhonelogStandIn
+from testmodem import percentile
+
+USERNAME, PASSWORD = 'workstation33', 'sEcReT!'
+
+PROFILES = {
+    'no faults': {},
+    'latency exp:0.02': {'latency': 'exp:0.02'},
+    'latency lognormal:0.02:1': {'latency': 'lognormal:0.02:1'},
+    'faults: 2% 503, 1% failure, 1% reset, 1% slow': {
+        'latency': 'exp:0.02', 'error_rate': 0.02, 'fail_rate': 0.01,
+        'reset_rate': 0.01, 'slow_rate': 0.01, 'slow_seconds': 2.0},
+}
+
+
+def _identity_cache(**kwargs):
+    # the console user comes from query.exe, which isn't here
+    import console_user # pylint: disable=import-outside-toplevel
+    return console_user.IdentityCache(session_source=lambda: 'user1', **kwargs)
+
+
+def _make_certificate(directory):
+    # a self-signed certificate for 127.0.0.1, or None without openssl
+    if shutil.which('openssl') is None:
+        return None
+    certfile = os.path.join(directory, 'standin.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', certfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile
+
+
+def bench_dial(phonelog, server, threads, dials, pool_size=4, read_timeout=1.0):
+    """dials/sec, latencies and errors for `dials` dials from `threads`
+    threads through one PhoneLogDialer"""
+    # pylint: disable=too-many-arguments
+    config = {'hostname': server.hostname, 'scheme': server.scheme,
+              'username': USERNAME, 'password': PASSWORD, 'country_code': '+47',
+              'read_timeout': read_timeout, 'keepalive_interval': 0,
+              'pool_size': pool_size}
+    if server.scheme == 'https':
+        config['verify'] = server.certfile
+    with open('phonelog.json', 'w', encoding='utf-8') as json_file:
+        json.dump(config, json_file)
+    dialer = phonelog.PhoneLogDialer()
+    dialer.dial('22 33 44 55')     # connected, and the identity looked up
+
+    latencies = []
+    errors = collections.Counter()
+    lock = threading.Lock()
+
+    def dial(i):
+        start = time.perf_counter()
+        try:
+            dialer.dial(f'22 {i % 100:02d} 44 55')
+        except Exception as exc: # pylint: disable=broad-except
+            with lock:
+                errors[type(exc).__name__] += 1
+        else:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    with concurrent.futures.ThreadPoolExecutor(threads, initializer=dialer.initialize_thread) \
+            as pool:
+        start = time.perf_counter()
+        list(pool.map(dial, range(dials)))
+        seconds = time.perf_counter() - start
+    dialer.close()
+    return dials / seconds, latencies, dict(errors)
+
+
+def main():
+    """runs every profile with 1, 4 and 16 dialing threads"""
+    bench_active_directory.install()
+    bench_active_directory.populate(10)
+    import phonelog # pylint: disable=import-outside-toplevel
+    phonelog.IdentityCache = _identity_cache
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            runs = [(name, settings, None) for name, settings in PROFILES.items()]
+            certfile = _make_certificate(directory)
+            if certfile is not None:
+                runs += [(f'{name}, https', settings, certfile)
+                         for name, settings in PROFILES.items() if 'error_rate' not in settings]
+            for name, settings, certfile in runs:
+                for threads in (1, 4, 16):
+                    server = PhonelogStandIn(username=USERNAME, password=PASSWORD,
+                                             faults=Faults(seed=1, **settings),
+                                             certfile=certfile).start()
+                    try:
+                        rate, latencies, errors = bench_dial(phonelog, server, threads,
+                                                             dials=100 * threads)
+                    finally:
+                        server.stop()
+                    print(f"{name}, {threads:2d} threads: {rate:7.1f} dials/sec,"
+                          f" ms p50 {percentile(latencies, 0.5) * 1000:6.1f}"
+                          f" p99 {percentile(latencies, 0.99) * 1000:6.1f}"
+                          f" max {max(latencies, default=float('nan')) * 1000:6.1f},"
+                          f" errors {errors or 'none'}")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 from collections import namedtuple
+import logging
 import os
 import subprocess
+import threading
+import time
 
-import active_directory as ad
-from e164 import to_e164
+import directory
+from e164 import ImpossibleNumber, to_e164
+import metrics
 
 
 systemroot = os.getenv('SystemRoot', 'C:\\Windows')
@@ -15,6 +19,17 @@ QueryUserOutput = namedtuple(
     ['username', 'sessionname', 'id', 'state', 'idle_time', 'logon_date', 'logon_time']
 )
 
+Identity = namedtuple('Identity', ['user', 'email', 'phone'])
+
+_IDENTITY_CACHE = metrics.counter('identity_cache_requests_total',
+                                  'Console user identities asked for, by whether the'
+                                  ' cache had them (hit) or they were looked up (miss)',
+                                  ('result',))
+_IDENTITY_LOOKUP_SECONDS = metrics.histogram('identity_lookup_seconds',
+                                             'Time to find the console user (console_user)'
+                                             ' and to look the user up (directory)',
+                                             ('stage',))
+
 
 def console_user():
     """Returns the samAccountName of the user currently logged into the console"""
@@ -31,22 +46,42 @@ def console_user():
     return None
 
 
-def user2email(user):
-    """Returns the email address of `user` from active directory, or None"""
+def _e164_or_none(phone, country_code, local_code):
+    # a directory phone number in E.164 format, or None if there is none
+    # or it can't be dialed
+    if phone is None:
+        return None
     try:
-        return ad.find_user(user).mail
-    except:
+        return to_e164(phone, country_code, local_code)
+    except ImpossibleNumber:
         return None
 
 
-def user2phone(user, country_code='', local_code=''):
-    """Returns the phone number of `user` from active directory, or None"""
+def _lookup_email_and_phone(user, country_code, local_code):
+    # as user2email_and_phone, but a failed lookup raises
+    record = directory.backend().lookup_user(user, ('mail', 'telephoneNumber'))
+    if record is None:
+        return None, None
+    return record.mail, _e164_or_none(record.telephoneNumber, country_code, local_code)
+
+
+def user2email_and_phone(user, country_code='', local_code=''):
+    """Returns the email address and phone number of `user` from active directory,
+    each of them None if not found, with a single directory query"""
     try:
-        return to_e164(ad.find_user(user).telephoneNumber,
-                       country_code,
-                       local_code)
+        return _lookup_email_and_phone(user, country_code, local_code)
     except:
-        return None
+        return None, None
+
+
+def user2email(user):
+    """Returns the email address of `user` from active directory, or None"""
+    return user2email_and_phone(user)[0]
+
+
+def user2phone(user, country_code='', local_code=''):
+    """Returns the phone number of `user` from active directory, or None"""
+    return user2email_and_phone(user, country_code, local_code)[1]
 
 
 def console_user_email():
@@ -58,8 +93,148 @@ def console_user_phone(country_code='', local_code=''):
 
 
 def console_user_email_and_phone(country_code='', local_code=''):
-    user = console_user()
-    return user2email(user), user2phone(user, country_code, local_code)
+    return user2email_and_phone(console_user(), country_code, local_code)
+
+
+def directory_identity(user, country_code='', local_code=''):
+    """Returns the Identity of `user` from active directory; raises if the
+    directory can't be asked"""
+    if user is None:
+        return Identity(None, None, None)
+    return Identity(user, *_lookup_email_and_phone(user, country_code, local_code))
+
+
+def directory_identities(users, country_code='', local_code=''):
+    """Returns {user: Identity} for many users at once, e.g. for warming a cache"""
+    records = directory.backend().find_users(users, ('mail', 'telephoneNumber'))
+    identities = {}
+    for user in users:
+        record = records.get(user)
+        if record is None:
+            identities[user] = Identity(user, None, None)
+            continue
+        identities[user] = Identity(user, record.mail,
+                                    _e164_or_none(record.telephoneNumber,
+                                                  country_code, local_code))
+    return identities
+
+
+class IdentityCache:
+    """Keeps the Identity of the console user in memory, so reading it is cheap
+
+    A background thread asks `session_source()` who the console user is
+    every `poll_interval` seconds, and looks the user up with
+    `resolver(user)` when the user changes or the last lookup is older than
+    `ttl` seconds. The defaults are query.exe and active directory, other
+    sources may be plugged in (for instance for testing).
+
+    A lookup that fails (raises) changes nothing: the last identity found
+    is kept, and the lookup is tried again at the next poll.
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, session_source=console_user, resolver=directory_identity,
+                 ttl=300, poll_interval=5, initializer=None):
+        self._session_source = session_source
+        self._resolver = resolver
+        self._ttl = ttl
+        self._poll_interval = poll_interval
+        self._initializer = initializer
+
+        self._lock = threading.Lock()
+        self._user = None
+        self._polled = None         # when session_source was last asked
+        self._identity = None
+        self._resolved = None       # when self._identity was looked up
+        self._stopped = threading.Event()
+        self._thread = None
+        self._hits = _IDENTITY_CACHE.labels('hit')
+        self._misses = _IDENTITY_CACHE.labels('miss')
+        self._poll_seconds = _IDENTITY_LOOKUP_SECONDS.labels('console_user')
+        self._resolve_seconds = _IDENTITY_LOOKUP_SECONDS.labels('directory')
+
+
+    def start(self):
+        """starts refreshing in the background"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='identity-refresher',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+
+    def stop(self):
+        """stops refreshing in the background"""
+        self._stopped.set()
+        self._thread = None
+
+
+    def get(self):
+        """Returns the Identity of the console user"""
+        now = time.monotonic()
+        with self._lock:
+            user, polled = self._user, self._polled
+            identity, resolved = self._identity, self._resolved
+        # Only do the work here if the background thread isn't keeping up
+        hit = True
+        if polled is None or now - polled > 2 * self._poll_interval:
+            user = self._poll()
+            hit = False
+        if identity is None or identity.user != user or now - resolved > self._ttl:
+            hit = False
+            try:
+                identity = self._resolve(user)
+            except Exception: # pylint: disable=broad-except
+                # an outdated identity of the same user is better than none
+                logging.getLogger('console_user').warning('looking up %s failed', user,
+                                                          exc_info=True)
+                if identity is None or identity.user != user:
+                    identity = Identity(user, None, None)
+        (self._hits if hit else self._misses).inc()
+        return identity
+
+
+    def _poll(self):
+        start = time.perf_counter()
+        user = self._session_source()
+        self._poll_seconds.observe(time.perf_counter() - start)
+        with self._lock:
+            self._user = user
+            self._polled = time.monotonic()
+        return user
+
+
+    def _resolve(self, user):
+        start = time.perf_counter()
+        identity = self._resolver(user)
+        self._resolve_seconds.observe(time.perf_counter() - start)
+        with self._lock:
+            if self._user == user:
+                self._identity = identity
+                self._resolved = time.monotonic()
+        return identity
+
+
+    def _refresh(self):
+        user = self._poll()
+        with self._lock:
+            # a little early, so get() never finds it stale
+            stale = (self._identity is None or self._identity.user != user or
+                     time.monotonic() - self._resolved > self._ttl - self._poll_interval)
+        if stale:
+            self._resolve(user)
+
+
+    def _run(self):
+        if self._initializer is not None:
+            self._initializer()
+        while True:
+            try:
+                self._refresh()
+            except Exception: # pylint: disable=broad-except
+                logging.getLogger('console_user').exception('refreshing console user failed')
+            if self._stopped.wait(self._poll_interval):
+                return
 
 
 if __name__ == "__main__":
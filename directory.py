@@ -0,0 +1,167 @@
+"""Directory backends: where the lookups of users for dialing go
+
+Every backend has these methods:
+
+    lookup_user(name, attributes)
+        the named attributes of the user with sAMAccountName, displayName
+        or cn `name`, as a Record, or None
+    find_users(names, attributes)
+        a dict of name => Record for many names at once, matched as by
+        lookup_user, in as few round trips as possible
+    lookup_users(attributes, server=None, changed_since=None)
+        Records for all users, or only those with uSNChanged > changed_since,
+        as seen by domain controller `server`
+    domain_controller()
+        the domain controller lookups currently go to
+
+and may have:
+
+    initialize_thread()
+        prepares a thread other than the main thread for lookups
+
+Backends:
+ - ADSIDirectory: Active Directory through ADSI/ADO (COM, Windows only)
+ - ldap_directory.LDAPDirectory: plain LDAP in pure Python, on any platform
+"""
+import metrics
+
+
+class Record:
+    """Compact, read-only result of a lookup: the values of one row in a
+    tuple, found by name through a field index shared by every row of the
+    same query."""
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+    def __getitem__(self, name):
+        return self._values[self._index[name]]
+
+
+    def get(self, name, default=None):
+        """the value of field `name`, or `default`"""
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={self._values[i]!r}' for name, i in self._index.items())
+        return f'<Record: {fields}>'
+
+
+def to_int64(value):
+    """Returns an update sequence number (uSNChanged) as an int, whether it
+    came as an int, a string, or an ADSI large integer (HighPart/LowPart)"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return int(value)
+    high, low = value.HighPart, value.LowPart
+    return (high << 32) + (low & 0xffffffff)
+
+
+class ADSIDirectory:
+    """Looks users up in Active Directory through active_directory (COM)"""
+    def __init__(self):
+        import active_directory # pylint: disable=import-outside-toplevel
+        self._ad = active_directory
+
+
+    def lookup_user(self, name, attributes):
+        """the named attributes of user `name`, as a Record, or None"""
+        return self._ad.lookup_user(name, attributes)
+
+
+    def find_users(self, names, attributes):
+        """name => Record with the named attributes, for all `names` found"""
+        return self._ad.find_users(names, attributes)
+
+
+    def lookup_users(self, attributes, server=None, changed_since=None):
+        """Records for all users, or those changed since `changed_since`"""
+        clauses = [] if changed_since is None else [f'uSNChanged>={changed_since + 1}']
+        return self._ad.AD(server).lookup(*clauses, objectCategory='Person',
+                                          objectClass='User', attributes=attributes)
+
+
+    def domain_controller(self):
+        """the domain controller lookups currently go to"""
+        return self._ad.domain_controller()
+
+
+    @staticmethod
+    def initialize_thread():
+        """joins the thread to the multithreaded COM apartment, so cached
+        directory objects may be used from any thread"""
+        import pythoncom # pylint: disable=import-outside-toplevel
+        pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+
+
+    def cache_stats(self):
+        """the size of the AD object cache, and its hits, misses,
+        evictions and expirations"""
+        return self._ad.cache_stats()
+
+
+_backend = None
+
+
+def backend():
+    """Returns the directory backend in use (by default ADSIDirectory)"""
+    global _backend # pylint: disable=global-statement
+    if _backend is None:
+        _backend = ADSIDirectory()
+    return _backend
+
+
+def set_backend(new_backend):
+    """Makes `new_backend` the directory backend in use"""
+    global _backend # pylint: disable=global-statement
+    _backend = new_backend
+
+
+def _cache_stats():
+    # statistics of the object cache of the backend in use, if it has one
+    # and is in use already
+    stats = getattr(_backend, 'cache_stats', None)
+    return stats() if stats is not None else {}
+
+
+metrics.callback('directory_cache_requests_total',
+                 'Directory objects asked for, by whether the cache had them',
+                 lambda: {(result,): _cache_stats().get(key, 0)
+                          for result, key in [('hit', 'hits'), ('miss', 'misses')]},
+                 ('result',), kind='counter')
+metrics.callback('directory_cache_removals_total',
+                 'Directory objects removed from the cache, because it was full'
+                 ' (size) or they were too old (age)',
+                 lambda: {(reason,): _cache_stats().get(key, 0)
+                          for reason, key in [('size', 'evictions'), ('age', 'expirations')]},
+                 ('reason',), kind='counter')
+metrics.callback('directory_cache_size', 'Directory objects in the cache',
+                 lambda: _cache_stats().get('size', 0))
+
+
+def backend_from_config(data):
+    """Creates the backend described by `data` (the "directory" setting in
+    phonelog.json): {"backend": "ldap", "server": ..., ...}, or {} for ADSI"""
+    data = dict(data or {})
+    kind = data.pop('backend', 'adsi')
+    if kind == 'adsi':
+        return ADSIDirectory()
+    if kind == 'ldap':
+        from ldap_directory import LDAPDirectory # pylint: disable=import-outside-toplevel
+        return LDAPDirectory(**data)
+    raise ValueError(f"unknown directory backend '{kind}'")
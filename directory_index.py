@@ -0,0 +1,166 @@
+"""A local index of the directory fields used for dialing
+
+Maps sAMAccountName to mail, telephoneNumber and the phone number in
+E.164 format. The index is kept in a small gzipped JSON file, so it is
+available at startup even when the domain controller is slow or down,
+and kept fresh in the background by asking the directory only for users
+changed (uSNChanged) since the last sync.
+
+Deleted and renamed accounts are not among the changed users, so every
+`full_sync_interval` seconds (a day by default) all users are fetched
+again, and what the directory no longer has is dropped from the index.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+from console_user import Identity, directory_identity
+import directory
+from e164 import to_e164_many
+
+
+_ATTRIBUTES = ('sAMAccountName', 'mail', 'telephoneNumber', 'uSNChanged')
+
+
+class DirectoryIndex:
+    """sAMAccountName -> (mail, telephoneNumber, E.164 phone number), in memory"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, path='directory-index.json.gz', country_code='', local_code='',
+                 full_sync_interval=86400):
+        self._path = path
+        self._country_code = country_code
+        self._local_code = local_code
+        self._full_sync_interval = full_sync_interval
+        self._log = logging.getLogger('directory_index')
+
+        self._lock = threading.Lock()
+        self._users = {}
+        self._server = None     # the domain controller self._usn belongs to
+        self._usn = 0           # highest uSNChanged seen
+        self._full_synced = 0.0 # when all users were last fetched (time.time())
+        self._stopped = threading.Event()
+        self._thread = None
+        self.load()
+
+
+    def __len__(self):
+        return len(self._users)
+
+
+    def get(self, user):
+        """Returns (mail, telephoneNumber, E.164 phone number) for `user`, or None"""
+        if user is None:
+            return None
+        return self._users.get(user.lower())
+
+
+    def identity(self, user):
+        """Returns the Identity of `user`, from the index if it is there,
+        otherwise straight from the directory"""
+        entry = self.get(user)
+        if entry is None:
+            return directory_identity(user, self._country_code, self._local_code)
+        return Identity(user, entry[0], entry[2])
+
+
+    def load(self):
+        """reads the index file, if there is one"""
+        try:
+            with gzip.open(self._path, 'rt', encoding='utf-8') as index_file:
+                data = json.load(index_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            self._log.warning('ignoring unreadable index %s: %r', self._path, exc)
+            return
+        with self._lock:
+            self._users = {name: tuple(entry) for name, entry in data['users'].items()}
+            self._server = data['server']
+            self._usn = data['usn']
+            self._full_synced = data.get('full_synced', 0.0)
+
+
+    def save(self):
+        """writes the index file"""
+        with self._lock:
+            data = {'server': self._server, 'usn': self._usn,
+                    'full_synced': self._full_synced, 'users': self._users}
+            temporary = self._path + '.tmp'
+            with gzip.open(temporary, 'wt', encoding='utf-8') as index_file:
+                json.dump(data, index_file, separators=(',', ':'))
+        os.replace(temporary, self._path)
+
+
+    def sync(self, full=False):
+        """brings the index up to date with the directory, returns the number
+        of users changed (or, in a full sync, fetched and dropped)
+
+        Only users changed since the last sync are fetched, unless `full` is
+        set or the last full sync is `full_sync_interval` seconds old. Update
+        sequence numbers belong to one domain controller, so if the
+        directory now answers from another one, everything is fetched again."""
+        backend = directory.backend()
+        server = backend.domain_controller()
+        now = time.time()
+        full = (full or server != self._server or
+                now - self._full_synced >= self._full_sync_interval)
+        usn = 0 if full else self._usn
+
+        users = {} if full else dict(self._users)
+        records = [record for record in backend.lookup_users(_ATTRIBUTES, server,
+                                                             None if full else usn)
+                   if record.sAMAccountName is not None]
+        phones = [record.telephoneNumber for record in records]
+        numbers = to_e164_many([phone for phone in phones if phone is not None],
+                               self._country_code, self._local_code)
+        numbers.reverse()
+        for record, phone in zip(records, phones):
+            e164 = None if phone is None else numbers.pop()
+            users[record.sAMAccountName.lower()] = (record.mail, phone, e164)
+            usn = max(usn, directory.to_int64(record.uSNChanged))
+        changed = len(records)
+        # users the directory no longer has (deleted, or renamed)
+        dropped = len(self._users.keys() - users.keys()) if full else 0
+
+        with self._lock:
+            self._users = users
+            self._server = server
+            self._usn = usn
+            if full:
+                self._full_synced = now
+        if changed or full:
+            self.save()
+            self._log.info('%s sync: %d users changed, %d dropped, %d in index',
+                           'full' if full else 'incremental', changed, dropped, len(users))
+        return changed + dropped
+
+
+    def start(self, interval=300, initializer=None):
+        """syncs now and every `interval` seconds, in the background"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval, initializer),
+                                            name='directory-index', daemon=True)
+            self._thread.start()
+        return self
+
+
+    def stop(self):
+        """stops syncing in the background"""
+        self._stopped.set()
+        self._thread = None
+
+
+    def _run(self, interval, initializer):
+        if initializer is not None:
+            initializer()
+        while True:
+            try:
+                self.sync()
+            except Exception: # pylint: disable=broad-except
+                self._log.exception('syncing the directory index failed')
+            if self._stopped.wait(interval):
+                return
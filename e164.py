@@ -1,28 +1,244 @@
-"""Convert phone number to E.164 format (digits prefixed by +)"""
+"""Convert phone number to E.164 format (digits prefixed by +)
+
+Numbers are read by the numbering plan of the country they are dialed
+from (`country_code`): its international prefix (00, 011 in North
+America, ...), its trunk prefix (0, 1 in North America, 8 in Russia,
+none in Italy or Norway, ...) and, for short numbers, the local area
+code. The result must start with an assigned country calling code and
+have a national number of a length possible in that country, otherwise
+ImpossibleNumber is raised, so that it is never dialed.
+
+In countries without a trunk prefix, a leading 0 that makes a number
+impossible is taken for the outside-line prefix of a legacy dialer, and
+dropped.
+"""
+import functools
 import re
 
-def to_e164(number, country_code='', local_code=''):
-    """Convert phone number to E.164 format (digits prefixed by +)"""
-    number = str(number)
-    country_code = str(country_code)
-    local_code = str(local_code)
-    digits = re.sub(r'\D', '', number)
+import metrics
+
+_NON_DIGITS = re.compile(r'\D')
+_NON_DIGITS_OR_NEWLINES = re.compile(r'[^\d\n]')
+_INTERNATIONAL = re.compile(r'\+?(?:00)?')
+
+_MAX_DIGITS = 15        # in an E.164 number, country code included
+_MIN_NATIONAL = 4       # shortest national number where the plan doesn't say
+_OUTSIDE_LINE = '0'     # what legacy dialers send first to get an outside line
+
+# All assigned country calling codes (ITU-T E.164 Annex), no one of
+# them a prefix of another
+_COUNTRY_CODES = """
+1 7 20 27 30 31 32 33 34 36 39 40 41 43 44 45 46 47 48 49 51 52 53 54 55
+56 57 58 60 61 62 63 64 65 66 81 82 84 86 90 91 92 93 94 95 98
+211 212 213 216 218 220 221 222 223 224 225 226 227 228 229 230 231 232
+233 234 235 236 237 238 239 240 241 242 243 244 245 246 247 248 249 250
+251 252 253 254 255 256 257 258 260 261 262 263 264 265 266 267 268 269
+290 291 297 298 299 350 351 352 353 354 355 356 357 358 359 370 371 372
+373 374 375 376 377 378 379 380 381 382 383 385 386 387 389 420 421 423
+500 501 502 503 504 505 506 507 508 509 590 591 592 593 594 595 596 597
+598 599 670 672 673 674 675 676 677 678 679 680 681 682 683 685 686 687
+688 689 690 691 692 800 808 850 852 853 855 856 870 878 880 881 882 883
+886 888 960 961 962 963 964 965 966 967 968 970 971 972 973 974 975 976
+977 979 992 993 994 995 996 998
+"""
+
+# country code, trunk prefix (- for none), international prefix, and the
+# shortest and longest national number; countries not listed use 0, 00
+# and _MIN_NATIONAL up to what fits in _MAX_DIGITS
+_NUMBERING_PLANS = """
+1    1  011  10 10
+7    8  810  10 10
+20   0  00   8  10
+27   0  00   9  9
+30   -  00   10 10
+31   0  00   9  9
+32   0  00   8  9
+33   0  00   9  9
+34   -  00   9  9
+36   06 00   8  9
+39   -  00   6  11
+40   0  00   9  9
+41   0  00   9  9
+43   0  00   4  13
+44   0  00   7  10
+45   -  00   8  8
+46   0  00   7  13
+47   -  00   5  8
+48   -  00   9  9
+49   0  00   5  13
+52   -  00   10 10
+54   0  00   10 11
+55   0  00   10 11
+61   0  0011 9  9
+64   0  00   8  10
+65   -  000  8  8
+81   0  010  9  10
+82   0  001  8  11
+86   0  00   7  12
+90   0  00   10 10
+91   0  00   10 10
+298  -  00   6  6
+299  -  00   6  6
+351  -  00   9  9
+352  -  00   4  11
+353  0  00   7  9
+354  -  00   7  9
+358  0  00   5  12
+370  8  00   8  8
+371  -  00   8  8
+372  -  00   7  8
+380  0  00   9  9
+420  -  00   9  9
+421  0  00   9  9
+852  -  001  8  8
+971  0  00   8  9
+972  0  00   8  9
+"""
+
+
+class ImpossibleNumber(ValueError):
+    """A phone number that can't be dialed"""
+
+
+class _Country: # pylint: disable=too-few-public-methods
+    __slots__ = ('code', 'trunk_prefix', 'international_prefix',
+                 'min_length', 'max_length')
+
+    def __init__(self, code, trunk_prefix='0', international_prefix='00',
+                 min_length=_MIN_NATIONAL, max_length=None):
+        # pylint: disable=too-many-arguments
+        self.code = code
+        self.trunk_prefix = trunk_prefix
+        self.international_prefix = international_prefix
+        self.min_length = int(min_length)
+        self.max_length = int(max_length or _MAX_DIGITS - len(code))
+
+
+_UNKNOWN = _Country('')
+
 
-    if re.match(r'^\+', number):
-        return f"+{digits}"
+@functools.lru_cache(maxsize=None)
+def _trie():
+    # digit -> subtrie, and None -> _Country where a country code ends;
+    # built on first use, not at import
+    plans = {}
+    for line in _NUMBERING_PLANS.strip().splitlines():
+        code, trunk_prefix, international_prefix, min_length, max_length = line.split()
+        plans[code] = _Country(code, trunk_prefix.strip('-'), international_prefix,
+                               min_length, max_length)
+    trie = {}
+    for code in _COUNTRY_CODES.split():
+        node = trie
+        for digit in code:
+            node = node.setdefault(digit, {})
+        node[None] = plans.get(code) or _Country(code)
+    return trie
 
-    if re.match(r'^00', number):
-        return f"+{digits[2:]}"
 
-    if re.match(r'^\+', country_code):
-        country_code = country_code[1:]
-    if re.match(r'^00', country_code):
-        country_code = country_code[2:]
+def _country(digits):
+    # the country whose calling code `digits` starts with, or None
+    node = _trie()
+    for digit in digits[:3]:
+        node = node.get(digit)
+        if node is None:
+            return None
+        if None in node:
+            return node[None]
+    return None
 
-    if re.match(r'^0', number):
-        return f"+{country_code}{digits[1:]}"
 
-    if re.match(r'^0', local_code):
+def _home(country_code, local_code):
+    # the country numbers are dialed from, and the local code without
+    # its trunk prefix
+    country_code = country_code[_INTERNATIONAL.match(country_code).end():]
+    country = _country(country_code)
+    if country is None or country.code != country_code:
+        country = _UNKNOWN
+    local_code = _NON_DIGITS.sub('', local_code)
+    if country.trunk_prefix and local_code.startswith(country.trunk_prefix):
+        local_code = local_code[len(country.trunk_prefix):]
+    elif country is _UNKNOWN and local_code.startswith('0'):
         local_code = local_code[1:]
+    return country_code, country, local_code
+
+
+def _international(number, digits, home):
+    # the digits of `number`, country code first, as dialed from `home`
+    country_code, country, local_code = home
+    if number.lstrip().startswith('+'):
+        return digits
+    if digits.startswith(country.international_prefix):
+        return digits[len(country.international_prefix):]
+    if country.trunk_prefix and digits.startswith(country.trunk_prefix):
+        return country_code + digits[len(country.trunk_prefix):]
+    if local_code and len(local_code) + len(digits) <= country.max_length:
+        return country_code + local_code + digits
+    return country_code + digits
+
+
+def _impossible(number, international):
+    # why `international` can't be dialed, or None if it can
+    destination = _country(international)
+    if destination is None:
+        return f"'{number}': no such country code"
+    length = len(international) - len(destination.code)
+    if not destination.min_length <= length <= destination.max_length:
+        return (f"'{number}': {length} digits is not a possible"
+                f" national number in +{destination.code}")
+    return None
+
+
+def _from_digits(number, digits, home):
+    # number as given, its digits, and the country it is dialed from;
+    # returns the E.164 number or raises ImpossibleNumber
+    international = _international(number, digits, home)
+    problem = _impossible(number, international)
+    if problem is None:
+        return f"+{international}"
+    # Legacy dialers often send a 0 for an outside line. Where there is no
+    # trunk prefix to take it for, a national number that can't be dialed
+    # is dialed without it, as it was before numbering plans were read.
+    country_code, country, _ = home
+    if (not country.trunk_prefix and digits.startswith(_OUTSIDE_LINE) and
+            not number.lstrip().startswith('+') and
+            not digits.startswith(country.international_prefix)):
+        international = country_code + digits[len(_OUTSIDE_LINE):]
+        if _impossible(number, international) is None:
+            return f"+{international}"
+    raise ImpossibleNumber(problem)
+
+
+@functools.lru_cache(maxsize=4096)
+def _to_e164(number, country_code, local_code):
+    return _from_digits(number, _NON_DIGITS.sub('', number), _home(country_code, local_code))
+
+
+metrics.callback('e164_cache_requests_total',
+                 'Phone numbers converted, by whether the cache had them',
+                 lambda: {('hit',): _to_e164.cache_info().hits,
+                          ('miss',): _to_e164.cache_info().misses},
+                 ('result',), kind='counter')
+
+
+def to_e164(number, country_code='', local_code=''):
+    """Convert phone number to E.164 format (digits prefixed by +), as
+    dialed from `country_code` in area `local_code`; raises
+    ImpossibleNumber if it can't be dialed"""
+    return _to_e164(str(number), str(country_code), str(local_code))
+
 
-    return f"+{country_code}{local_code}{digits}"
+def to_e164_many(numbers, country_code='', local_code=''):
+    """Convert many phone numbers to E.164 format at once, e.g. a whole
+    directory export; returns a list in the same order, with None for
+    the numbers that can't be dialed"""
+    numbers = [str(number).replace('\n', ' ') for number in numbers]
+    home = _home(str(country_code), str(local_code))
+    # strip the non-digits of all numbers with one substitution
+    digits = _NON_DIGITS_OR_NEWLINES.sub('', '\n'.join(numbers)).split('\n')
+    converted = []
+    for number, number_digits in zip(numbers, digits):
+        try:
+            converted.append(_from_digits(number, number_digits, home))
+        except ImpossibleNumber:
+            converted.append(None)
+    return converted
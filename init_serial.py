@@ -1,15 +1,58 @@
-"""initializes serial port as given in serial.json"""
+"""initializes serial ports as given in serial.json
+
+serial.json holds either one port definition, or a list of them:
+
+    [{"port": "COM4", "baudrate": 9600}, {"port": "COM6", "dial_result": "immediate"}]
+
+"dial_result" decides when a modem on the port answers ATD, see
+modem.DIAL_RESULTS; main.py runs AsyncModems, which can't dial "inline"
+
+"trace" records the port's sessions in a file, see session_trace; "{port}"
+in it is replaced with the port, so one setting can serve every port:
+
+    {"port": "COM4", "trace": "traces/{port}.trace"}
+"""
 import json
 import re
 
 import serial
 
+from async_modem import DIAL_RESULTS
 
-def init_serial():
-    """initializes serial port as given in serial.json"""
+
+def _port_definitions():
     with open('serial.json', encoding='utf8') as json_file:
         data = json.load(json_file)
+    return data if isinstance(data, list) else [data]
+
+
+def init_serial():
+    """initializes the (first) serial port given in serial.json"""
+    return _open_port(_port_definitions()[0])
+
+
+def init_serials():
+    """initializes all serial ports given in serial.json,
+    returns a list of (serial port, modem settings) pairs"""
+    definitions = _port_definitions()
+    ports = [definition['port'] for definition in definitions]
+    assert len(set(ports)) == len(ports), "serial.json: the same port is given twice"
+    return [(_open_port(definition), _modem_settings(definition))
+            for definition in definitions]
+
+
+def _modem_settings(data):
+    dial_result = data.get('dial_result', 'deferred')
+    assert dial_result in DIAL_RESULTS, \
+        f"serial.json: {data['port']}: dial_result must be one of {DIAL_RESULTS}," \
+        f" not {dial_result!r}"
+    settings = {'dial_result': dial_result}
+    if 'trace' in data:
+        settings['trace'] = data['trace'].format(port=data['port'])
+    return settings
+
 
+def _open_port(data):
     port = data['port']
     baudrate = data['baudrate'] if 'baudrate' in data else 115200
     bytesize = data['bytesize'] if 'bytesize' in data else 8
@@ -0,0 +1,231 @@
+"""A directory backend speaking LDAP directly (pure Python, no COM)
+
+Uses ldap3. Connections are bound once and kept in a pool, so lookups
+from many threads each get a ready connection, and large results are
+fetched with the paged results control.
+
+    from ldap_directory import LDAPDirectory
+    directory = LDAPDirectory('dc1.example.com', user='EXAMPLE\\\\svc-modem', password='...')
+    print(directory.lookup_user('goldent', ('mail', 'telephoneNumber')))
+"""
+import concurrent.futures
+import logging
+import queue
+import threading
+
+import ldap3
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.conv import escape_filter_chars
+
+from directory import Record
+
+
+_USERS = '(objectCategory=Person)(objectClass=user)'
+_USER_NAME_ATTRIBUTES = ('sAMAccountName', 'displayName', 'cn')
+
+
+def _value(value):
+    # ldap3 gives lists for attributes it doesn't know to be single-valued
+    if isinstance(value, list):
+        if len(value) == 0:
+            return None
+        if len(value) == 1:
+            return value[0]
+        return tuple(value)
+    return value
+
+
+def _user_filter(name):
+    name = escape_filter_chars(name)
+    return f'(|(sAMAccountName={name})(displayName={name})(cn={name}))'
+
+
+class LDAPDirectory:
+    """Looks users up over LDAP, through a pool of bound connections"""
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, server, base=None, user=None, password=None, use_ssl=False,
+                 pool_size=4, page_size=500, timeout=10, connection_factory=None):
+        self._host = server
+        self._user = user
+        self._password = password
+        self._use_ssl = use_ssl
+        self._timeout = timeout
+        self._page_size = page_size
+        self._connection_factory = connection_factory or self._connect
+        self._log = logging.getLogger('ldap_directory')
+
+        self._pool = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pool_size = pool_size
+        self._connections = 0   # created and not discarded, in the pool or in use
+
+        # without a base, the domain's naming context, looked up at the first
+        # search: the directory may well be down when this is made
+        self._base = base
+        self._server_name = None
+
+
+    def _connect(self):
+        server = ldap3.Server(self._host, use_ssl=self._use_ssl, get_info=ldap3.DSA,
+                              connect_timeout=self._timeout)
+        return ldap3.Connection(server, user=self._user, password=self._password,
+                                authentication=ldap3.NTLM if self._user and '\\' in self._user
+                                else ldap3.SIMPLE,
+                                auto_bind=True, receive_timeout=self._timeout,
+                                read_only=True)
+
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._connections < self._pool_size
+            if create:
+                self._connections += 1
+        if not create:
+            try:
+                return self._pool.get(timeout=self._timeout)
+            except queue.Empty:
+                raise LDAPException(f'no LDAP connection free within {self._timeout} s'
+                                    f' ({self._pool_size} in the pool)') from None
+        try:
+            return self._connection_factory()
+        except:
+            with self._lock:
+                self._connections -= 1
+            raise
+
+
+    def _release(self, connection):
+        self._pool.put(connection)
+
+
+    def _discard(self, connection):
+        with self._lock:
+            self._connections -= 1
+        try:
+            connection.unbind()
+        except LDAPException:
+            pass
+
+
+    def _search(self, search_filter, attributes):
+        # All results, fetched page by page, as Records. A connection that
+        # fails is thrown away and the search is tried once more on another;
+        # one left in an unknown state by any other error is thrown away too.
+        attributes = tuple(attributes)
+        index = {name: i for i, name in enumerate(attributes)}
+        if self._base is None:
+            self._base = self._root_attribute('defaultNamingContext')
+        for attempt in range(2):
+            connection = self._acquire()
+            done = False
+            try:
+                entries = connection.extend.standard.paged_search(
+                    self._base, search_filter, search_scope=ldap3.SUBTREE,
+                    attributes=list(attributes), paged_size=self._page_size, generator=True)
+                records = [Record(index, tuple(_value(entry['attributes'].get(name))
+                                               for name in attributes))
+                           for entry in entries if entry.get('type') == 'searchResEntry']
+                done = True
+                return records
+            except LDAPException:
+                if attempt == 1:
+                    raise
+                self._log.warning('LDAP connection failed, reconnecting', exc_info=True)
+            finally:
+                if done:
+                    self._release(connection)
+                else:
+                    self._discard(connection)
+        raise AssertionError('not reached')
+
+
+    def _root_attribute(self, name):
+        connection = self._acquire()
+        try:
+            info = connection.server.info
+            value = None if info is None else info.other.get(name)
+        finally:
+            self._release(connection)
+        return _value(value)
+
+
+    def lookup(self, *filters, attributes=('distinguishedName',), **kwargs):
+        """Records with the named attributes of every object matching all of
+        `filters` (LDAP filter strings) and attribute=value pairs"""
+        clauses = list(filters)
+        clauses += [f'({key}={escape_filter_chars(str(value))})' for key, value in kwargs.items()]
+        return self._search(f"(&{''.join(clauses)})", attributes)
+
+
+    def lookup_user(self, name, attributes):
+        """the named attributes of user `name`, as a Record, or None"""
+        for record in self._search(f'(&{_USERS}{_user_filter(name)})', attributes):
+            return record
+        return None
+
+
+    def find_users(self, names, attributes, chunk_size=100):
+        """name => Record with the named attributes, for all `names` found;
+        the names go into OR-ed filters of `chunk_size` names, searched at
+        the same time on as many pooled connections as there are"""
+        names = list(names)
+        wanted = {name.lower(): name for name in names}
+        selected = tuple(attributes) + tuple(name for name in _USER_NAME_ATTRIBUTES
+                                             if name not in attributes)
+        chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+        filters = [f"(&{_USERS}(|{''.join(_user_filter(name) for name in chunk)}))"
+                   for chunk in chunks]
+        found = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._pool_size) as executor:
+            for records in executor.map(lambda search_filter: self._search(search_filter, selected),
+                                        filters):
+                for record in records:
+                    for attribute in _USER_NAME_ATTRIBUTES:
+                        name = wanted.get(str(record[attribute] or '').lower())
+                        if name is not None and name not in found:
+                            found[name] = record
+        return found
+
+
+    def lookup_users(self, attributes, server=None, changed_since=None):
+        """Records for all users, or those changed since `changed_since`;
+        always asks the server this directory is connected to"""
+        # pylint: disable=unused-argument
+        changed = '' if changed_since is None else f'(uSNChanged>={changed_since + 1})'
+        return self._search(f'(&{_USERS}{changed})', attributes)
+
+
+    def domain_controller(self):
+        """the domain controller lookups go to"""
+        if self._server_name is None:
+            self._server_name = self._root_attribute('dnsHostName') or self._host
+        return self._server_name
+
+
+    @classmethod
+    def mock(cls, entries, base='DC=example,DC=com', **kwargs):
+        """An LDAPDirectory over an in-memory mock server holding `entries`
+        ({distinguished name: attributes}), for trying things out without a
+        domain controller"""
+        server = ldap3.Server('mock', get_info=ldap3.OFFLINE_AD_2012_R2)
+        loader = ldap3.Connection(server, client_strategy=ldap3.MOCK_SYNC)
+        for dn, attributes in entries.items():
+            loader.strategy.add_entry(dn, attributes)
+
+        def connect():
+            connection = ldap3.Connection(server, client_strategy=ldap3.MOCK_SYNC)
+            connection.bind()
+            return connection
+
+        return cls('mock', base=base, connection_factory=connect, **kwargs)
+
+
+if __name__ == "__main__":
+    import sys
+
+    directory = LDAPDirectory(sys.argv[1])
+    print(directory.lookup_user(sys.argv[2], ('mail', 'telephoneNumber')))
@@ -0,0 +1,317 @@
+"""load generator for the modem emulator (run: python loadgen.py --help)
+
+Starts a bank of AsyncModems, set up like main.py does it (one event loop,
+one shared DialPool), in a process of its own, and drives it with virtual
+dialing clients over pseudo terminals (not Windows). Each client replays
+AT scripts like the ones legacy dialing programs send (init strings,
+ATDT, ATH, +++ escapes), with a random think time between sessions.
+
+The load is stepped up through --clients, and for each step the echo and
+result code latencies are reported. The saturation point is the first
+step where the p99 echo latency goes above --max-latency or replies time
+out or are unexpected (BUSY when the DialPool is full), or, with --rate 0,
+where each client gets through noticeably fewer commands per second than
+in the first step.
+"""
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import os
+import random
+import re
+import resource
+import statistics
+import time
+import tty
+
+from testmodem import QuietDialer, percentile
+
+_EXPECT_TIMEOUT = 10    # seconds to wait for a reply before counting an error
+_RESULT_CODE = re.compile(b'\r\n([A-Z][A-Z ]*)\r\n')
+_GUARD_TIME = 5         # S12 for the escape script, 1/50 s
+
+# Scripts: (line sent, reply expected after the echo). A line of None
+# sends +++ after the guard time instead.
+SCRIPTS = {
+    'dial': [('ATZ', 'OK'), ('ATDT {number}', 'OK'), ('ATH', 'OK')],
+    'init': [('ATE1V1Q0X4S0=0S7=60L0M0', 'OK'), ('ATS2=43S3=13S4=10S5=8', 'OK'),
+             ('AT&F', 'ERROR'), ('ATZ', 'OK')],
+    'escape': [(f'ATS12={_GUARD_TIME}', 'OK'), ('ATO999', 'CONNECT'),
+               (None, 'NO CARRIER'), ('ATZ', 'OK')],
+}
+
+
+class LatencyDialer:
+    """A dialer that takes its time, like a remote API"""
+    def __init__(self, latency=0.3, spread=0.1):
+        self._latency = latency
+        self._spread = spread
+
+    def dial(self, to_number): # pylint: disable=unused-argument
+        """pretend to dial a number, for `latency` +- `spread` seconds"""
+        time.sleep(max(0.0, random.uniform(self._latency - self._spread,
+                                           self._latency + self._spread)))
+
+
+def _raise_fd_limit():
+    # every client uses a pty pair, and pyserial adds a pipe per port
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _run_bank(names, dial_settings, ready, stop):
+    # the modem bank, in a process of its own
+    # pylint: disable=import-outside-toplevel
+    import logging
+    import serial
+    from async_modem import AsyncModem, run_modems
+    from modem import DialPool
+
+    logging.disable(logging.INFO)
+    _raise_fd_limit()
+    dial_result, dial_latency, max_workers, max_pending = dial_settings
+    dialer = LatencyDialer(dial_latency) if dial_latency else QuietDialer()
+    dial_pool = DialPool(max_workers=max_workers, max_pending=max_pending)
+
+    async def serve():
+        modems = [AsyncModem(serial.Serial(name), dialer, name, dial_result, dial_pool)
+                  for name in names]
+        task = asyncio.ensure_future(run_modems(modems))
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(serve())
+
+
+class _Client:
+    """The terminal end of one modem's pty"""
+    def __init__(self, fd, loop):
+        self._fd = fd
+        self._buffer = bytearray()
+        self._data = asyncio.Event()
+        os.set_blocking(fd, False)
+        loop.add_reader(fd, self._on_readable)
+
+
+    def _on_readable(self):
+        try:
+            self._buffer += os.read(self._fd, 65536)
+        except (BlockingIOError, OSError):
+            return
+        self._data.set()
+
+
+    def send(self, data):
+        """writes all of `data`"""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+
+    async def expect(self, data):
+        """waits until `data` is read, returns the time it was; everything
+        read before it is thrown away"""
+        return (await self._read_until(lambda: self._found(data)))[0]
+
+
+    async def result_code(self):
+        """waits for a (verbose) result code, returns the time it was read
+        and the result code"""
+        return await self._read_until(self._found_result_code)
+
+
+    def _found(self, data):
+        end = self._buffer.find(data)
+        if end < 0:
+            return None
+        del self._buffer[:end + len(data)]
+        return data
+
+
+    def _found_result_code(self):
+        match = _RESULT_CODE.search(self._buffer)
+        if match is None:
+            return None
+        result = match.group(1).decode('ascii')
+        del self._buffer[:match.end()]
+        return result
+
+
+    async def _read_until(self, found):
+        deadline = time.perf_counter() + _EXPECT_TIMEOUT
+        while True:
+            value = found()
+            if value is not None:
+                return time.perf_counter(), value
+            self._data.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(self._data.wait(), remaining)
+
+
+class _Stats:
+    """what the clients measured during one step"""
+    def __init__(self):
+        self.echo = []      # seconds from line sent to its echo read
+        self.result = []    # seconds from line sent to its result code read
+        self.sessions = 0
+        self.commands = 0
+        self.errors = collections.Counter()    # unexpected replies, and timeouts
+
+
+async def _session(client, script, stats):
+    # runs one script, timing every line
+    for line, reply in script:
+        if line is None:
+            await asyncio.sleep(_GUARD_TIME / 50 * 1.2)
+            sent = time.perf_counter()
+            client.send(b'+++')
+            # the reply can only come after the guard time
+            sent += _GUARD_TIME / 50
+        else:
+            line = line.format(number=random.randint(10000000, 99999999)).encode('ascii')
+            sent = time.perf_counter()
+            client.send(line + b'\r')
+            stats.echo.append(await client.expect(line + b'\r\n') - sent)
+        received, result = await client.result_code()
+        stats.result.append(received - sent)
+        stats.commands += 1
+        if result != reply:
+            stats.errors[result] += 1
+            return
+    stats.sessions += 1
+
+
+async def _run_client(client, scripts, rate, stats, until):
+    # sessions with a random think time (mean 1/rate seconds) in between
+    while time.perf_counter() < until:
+        if rate:
+            await asyncio.sleep(random.expovariate(rate))
+        try:
+            await _session(client, SCRIPTS[random.choice(scripts)], stats)
+        except asyncio.TimeoutError:
+            stats.errors['timeout'] += 1
+
+
+async def _run_step(clients, scripts, rate, duration):
+    stats = _Stats()
+    until = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(_run_client(client, scripts, rate, stats, until)
+                           for client in clients))
+    return stats, time.perf_counter() - started
+
+
+def _report(count, stats, seconds, rate):
+    print(f"{count:5d} clients: {stats.sessions / seconds:8.1f} sessions/s"
+          f" ({'no think time' if not rate else f'{rate:g}/s per client between sessions'}),"
+          f" {stats.commands / seconds:8.1f} commands/s,"
+          f" errors: {dict(stats.errors) or 'none'}")
+    for name, values in [('echo', stats.echo), ('result', stats.result)]:
+        print(f"      {name:>6} ms: p50 {percentile(values, 0.5) * 1000:7.2f}"
+              f"  p90 {percentile(values, 0.9) * 1000:7.2f}"
+              f"  p99 {percentile(values, 0.99) * 1000:7.2f}"
+              f"  max {max(values, default=float('nan')) * 1000:7.2f}"
+              f"  mean {statistics.fmean(values) * 1000 if values else float('nan'):7.2f}")
+
+
+def _saturated(count, stats, seconds, args, per_client):
+    # why this step is past the saturation point, or None; `per_client` is
+    # the commands/s per client of the first step
+    p99 = percentile(stats.echo, 0.99) * 1000
+    if p99 > args.max_latency:
+        return f"p99 echo latency {p99:.1f} ms > {args.max_latency} ms"
+    if stats.errors:
+        return f"unexpected replies {dict(stats.errors)}"
+    # without think time each client waits only for its replies, so a
+    # slower modem bank shows up as fewer commands per client
+    if not args.rate and stats.commands / seconds / count < 0.8 * per_client:
+        return (f"{stats.commands / seconds / count:.1f} commands/s per client,"
+                f" down from {per_client:.1f}")
+    return None
+
+
+def main():
+    """runs the load steps"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', default='10,50,100,200',
+                        help='number of clients in each step, comma separated')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='sessions per second per client, 0 for no think time')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per step')
+    parser.add_argument('--scripts', default='dial,init,escape',
+                        help=f'scripts to pick from, of {",".join(SCRIPTS)}')
+    parser.add_argument('--dial-latency', type=float, default=0.0,
+                        help='seconds each dial takes (0 for none)')
+    parser.add_argument('--dial-result', default='deferred', choices=['deferred', 'immediate'])
+    parser.add_argument('--dial-workers', type=int, default=4,
+                        help='threads in the DialPool (as in main.py)')
+    parser.add_argument('--dial-pending', type=int, default=16,
+                        help='dials the DialPool accepts before answering BUSY')
+    parser.add_argument('--max-latency', type=float, default=50,
+                        help='p99 echo latency in ms that counts as saturated')
+    args = parser.parse_args()
+    steps = sorted(int(count) for count in args.clients.split(','))
+    scripts = args.scripts.split(',')
+
+    _raise_fd_limit()
+    masters, slaves = [], []
+    for _ in range(steps[-1]):
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        masters.append(master)
+        slaves.append(slave)
+
+    # the bank opens the ptys by name, they are kept open here until it has
+    # spawned, not forked, so the bank doesn't inherit the client ends
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    stop = context.Event()
+    bank = context.Process(
+        target=_run_bank,
+        args=([os.ttyname(slave) for slave in slaves],
+              (args.dial_result, args.dial_latency, args.dial_workers, args.dial_pending),
+              ready, stop),
+        daemon=True)
+    bank.start()
+    if not ready.wait(30):
+        raise RuntimeError('the modem bank did not start')
+    for slave in slaves:
+        os.close(slave)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        clients = [_Client(master, loop) for master in masters]
+        saturation = None
+        per_client = None
+        for count in steps:
+            stats, seconds = await _run_step(clients[:count], scripts, args.rate, args.duration)
+            _report(count, stats, seconds, args.rate)
+            if per_client is None:
+                per_client = stats.commands / seconds / count
+            reason = _saturated(count, stats, seconds, args, per_client)
+            if reason and saturation is None:
+                saturation = (count, reason)
+        if saturation is None:
+            print(f"not saturated at {steps[-1]} clients")
+        else:
+            print(f"saturated at {saturation[0]} clients: {saturation[1]}")
+
+    try:
+        asyncio.run(run())
+    finally:
+        stop.set()
+        bank.join(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 """the main program"""
+import asyncio
 import logging
-import sys
 
-from init_serial import init_serial
-import modem
+from async_modem import AsyncModem, run_modems
+from init_serial import init_serials
+import metrics
+from modem import DialPool
 from phonelog import PhoneLogDialer
 
 
@@ -14,7 +16,16 @@ if __name__ == "__main__":
         level=logging.INFO,
         datefmt="%Y-%m-%d %H:%M:%S")
 
-    serial_port = init_serial()
+    # counters and histograms, served over HTTP and/or dumped to a file if
+    # there is a metrics.json (see metrics-example.json)
+    metrics.start_from_config('metrics.json')
+
+    # One process serves every port in serial.json. The dialer (and with it
+    # the HTTP connections and directory caches) is shared, while each modem
+    # keeps its own S-registers and state. Dials run in a shared pool of
+    # threads, so a slow dial never stalls the event loop.
     dialer = PhoneLogDialer()
-    modem = modem.Modem(serial_port, dialer)
-    modem.run()
+    dial_pool = DialPool(initializer=dialer.initialize_thread)
+    modems = [AsyncModem(serial_port, dialer, serial_port.port, dial_pool=dial_pool, **settings)
+              for serial_port, settings in init_serials()]
+    asyncio.run(run_modems(modems))
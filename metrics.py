@@ -0,0 +1,339 @@
+"""Counters and histograms for the modem emulator and the dialer
+
+Metrics are made once, usually at import, and registered by name in a
+Registry (by default REGISTRY); making one that exists returns the one
+registered. Values are kept per combination of label values:
+
+    RESULTS = metrics.counter('modem_results_total', 'Result codes written',
+                              ('port', 'result'))
+    ok = RESULTS.labels('COM4', 'OK')      # look it up once
+    ok.inc()                                # then only a lock and an add
+
+Callbacks are read only when the metrics are collected, for values
+something else counts already (cache statistics).
+
+The metrics are exported, if metrics.json says so (see start_from_config),
+as Prometheus text over HTTP (GET /metrics), and/or as one JSON line per
+interval appended to a file.
+"""
+import bisect
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _CounterValue:
+    """The value of a counter for one combination of label values"""
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount=1):
+        """adds `amount`"""
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramValue:
+    """The observations of a histogram for one combination of label values"""
+    __slots__ = ('_buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value):
+        """counts `value` (seconds, usually)"""
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    """What counters and histograms have in common: a name, a help text,
+    label names, and a value per combination of label values"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._default = self.labels() if not self.labelnames else None
+
+
+    def _new_value(self):
+        raise NotImplementedError
+
+
+    def labels(self, *values):
+        """Returns the value for the given label values (as many as there
+        are label names), to be kept and updated"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name}: expected labels {self.labelnames}, got {values}')
+        key = tuple(str(value) for value in values)
+        value = self._values.get(key)
+        if value is None:
+            with self._lock:
+                value = self._values.setdefault(key, self._new_value())
+        return value
+
+
+    def _items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter(_Metric):
+    """A count that only goes up"""
+    kind = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+
+    def inc(self, amount=1):
+        """adds `amount`, for a counter without labels"""
+        self._default.inc(amount)
+
+
+    def samples(self):
+        """(name and labels, value) for every value"""
+        for key, value in self._items():
+            yield self.name + self._labels(key), value.value
+
+
+class Histogram(_Metric):
+    """Counts observations (latencies) in buckets, with their sum"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+
+    def observe(self, value):
+        """counts `value`, for a histogram without labels"""
+        self._default.observe(value)
+
+
+    def samples(self):
+        """(name and labels, value) for every bucket, sum and count"""
+        bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+        for key, value in self._items():
+            total = 0
+            for bound, count in zip(bounds, list(value.counts)):
+                total += count
+                yield self.name + '_bucket' + self._labels(key, [('le', bound)]), total
+            yield self.name + '_sum' + self._labels(key), value.sum
+            yield self.name + '_count' + self._labels(key), value.count
+
+
+class Callback:
+    """A metric whose values are asked for when it is collected: `func`
+    returns a number, or, with label names, {tuple of label values: number}"""
+    def __init__(self, name, documentation, func, labelnames=(), kind='gauge'):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._func = func
+
+
+    def samples(self):
+        """(name and labels, value) for every value"""
+        try:
+            values = self._func()
+        except Exception: # pylint: disable=broad-except
+            logging.getLogger('metrics').exception('collecting %s failed', self.name)
+            return
+        if not self.labelnames:
+            values = {(): values}
+        for key, value in values.items():
+            labels = ','.join(f'{name}="{_escape(label)}"'
+                              for name, label in zip(self.labelnames, key))
+            yield self.name + (f'{{{labels}}}' if labels else ''), value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else f'{value:.1f}'
+
+
+class Registry:
+    """The metrics there are, by name"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+
+    def register(self, metric):
+        """Registers `metric`, returns it, or the one registered by its name
+        already if that is the same kind of metric with the same labels"""
+        with self._lock:
+            registered = self._metrics.setdefault(metric.name, metric)
+        if (type(registered) is not type(metric) or registered.kind != metric.kind or
+                registered.labelnames != metric.labelnames):
+            raise ValueError(f'metric {metric.name} is registered already, differently')
+        return registered
+
+
+    def unregister(self, name):
+        """Forgets the metric `name`"""
+        with self._lock:
+            self._metrics.pop(name, None)
+
+
+    def _collect(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+
+    def text(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in self._collect():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {value}' for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+    def snapshot(self):
+        """All metrics as {name and labels: value}, as in the text format"""
+        return {name: value for metric in self._collect() for name, value in metric.samples()}
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=(), registry=REGISTRY):
+    """Returns the Counter `name`, made and registered if it isn't yet"""
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+    """Returns the Histogram `name`, made and registered if it isn't yet"""
+    # pylint: disable=too-many-arguments
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback(name, documentation, func, labelnames=(), kind='gauge', registry=REGISTRY):
+    """Registers a Callback, which replaces any registered by that name"""
+    # pylint: disable=too-many-arguments
+    registry.unregister(name)
+    return registry.register(Callback(name, documentation, func, labelnames, kind))
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Answers GET /metrics with the metrics in the Prometheus text format"""
+    def do_GET(self): # pylint: disable=invalid-name
+        """the metrics"""
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    """Serves the metrics of `registry` over HTTP, in a thread of its own"""
+    daemon_threads = True
+
+    def __init__(self, port=9108, host='127.0.0.1', registry=REGISTRY):
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+        threading.Thread(target=self.serve_forever, name='metrics-http', daemon=True).start()
+
+
+    def stop(self):
+        """stops serving"""
+        self.shutdown()
+        self.server_close()
+
+
+class JsonlDumper:
+    """Appends the metrics of `registry` to a file every `interval` seconds,
+    one JSON object per line: {"time": seconds since the epoch, "metrics": ...}"""
+    def __init__(self, path, interval=60, registry=REGISTRY):
+        self._path = path
+        self._interval = interval
+        self._registry = registry
+        self._stopped = threading.Event()
+        threading.Thread(target=self._run, name='metrics-jsonl', daemon=True).start()
+
+
+    def dump(self):
+        """appends the metrics now"""
+        line = json.dumps({'time': time.time(), 'metrics': self._registry.snapshot()})
+        with open(self._path, 'a', encoding='utf-8') as file:
+            file.write(line + '\n')
+
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.dump()
+            except OSError:
+                logging.getLogger('metrics').exception('writing %s failed', self._path)
+
+
+    def stop(self):
+        """dumps once more, and stops"""
+        self._stopped.set()
+        self.dump()
+
+
+def start_from_config(path='metrics.json', registry=REGISTRY):
+    """Starts exporting the metrics as the file at `path` says, if there is
+    one, e.g. {"http_port": 9108, "jsonl": "metrics.jsonl", "jsonl_interval": 60};
+    returns the exporters started"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as json_file:
+        data = json.load(json_file)
+    exporters = []
+    if 'http_port' in data:
+        exporters.append(MetricsServer(data['http_port'], data.get('http_host', '127.0.0.1'),
+                                       registry))
+    if 'jsonl' in data:
+        exporters.append(JsonlDumper(data['jsonl'], data.get('jsonl_interval', 60), registry))
+    return exporters
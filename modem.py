@@ -4,11 +4,16 @@ A modem emulator
  - meant for older software that uses a modem for dialing,
    emulate the modem and replace ATDT-commands with an api call
 """
+import concurrent.futures
 import enum
 import logging
 import re
+import threading
 import time
 
+import metrics
+from session_trace import RECEIVED, SENT, TraceWriter
+
 
 def _int0(string_of_digits): # convert string with digits to int, 0 if empty
     assert isinstance(string_of_digits, bytes)
@@ -43,6 +48,24 @@ class _ModemResult(enum.Enum):
     NO_ANSWER = 8
 
 _BUFSIZE = 4096      # number of bytes we try to read each time
+_LINE_BUFSIZE = 256  # longest command line, excess characters are dropped
+_DIAL_POLL_INTERVAL = 0.1   # how often a blocking modem checks for a finished dial
+
+# When to write the result code of a dial command (ATD):
+#   inline:    dial in the modem's own thread, result when the dial is done
+#   immediate: dial in a DialPool, result (OK) right away
+#   deferred:  dial in a DialPool, result (OK or ERROR) when the dial is done
+DIAL_RESULTS = ('inline', 'immediate', 'deferred')
+
+_RESULTS = metrics.counter('modem_results_total', 'Result codes written',
+                           ('port', 'result'))
+_RECEIVED_BYTES = metrics.counter('modem_received_bytes_total',
+                                  'Bytes read from the serial port', ('port',))
+_SENT_BYTES = metrics.counter('modem_sent_bytes_total',
+                              'Bytes written to the serial port', ('port',))
+_STATE_TRANSITIONS = metrics.counter('modem_state_transitions_total',
+                                     'Changes of state (command, online, online command)',
+                                     ('port', 'from', 'to'))
 
 class DummyDialer:
     """A dummy dialer for testing"""
@@ -51,28 +74,87 @@ class DummyDialer:
         print(f"Dummydialer dialing: {to_number}")
 
 
+class DialPool:
+    """Runs dials in a bounded pool of threads, may be shared by many modems"""
+    def __init__(self, max_workers=4, max_pending=16, initializer=None):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='dial', initializer=initializer)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+
+    def submit(self, dialer, to_number):
+        """starts dialer.dial(to_number), returns a concurrent.futures.Future,
+        or None when too many dials are already pending"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        future = self._executor.submit(dialer.dial, to_number)
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+
 class Modem:
     """Simulates a modem"""
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, serial_port, dialer):
-        self._command_log = logging.getLogger('command').info
-        self._response_log = logging.getLogger('response').info
+    def __init__(self, serial_port, dialer, name=None, dial_result='inline', dial_pool=None,
+                 trace=None):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        suffix = '' if name is None else f'.{name}'
+        self._command_log = logging.getLogger('command' + suffix).info
+        self._response_log = logging.getLogger('response' + suffix).info
 
         self._serial_port = serial_port
         self._dialer = dialer
 
+        if dial_result not in DIAL_RESULTS:
+            raise ValueError(f'dial_result must be one of {DIAL_RESULTS}')
+        self._dial_result = dial_result
+        if dial_pool is None and dial_result != 'inline':
+            dial_pool = DialPool(max_workers=1, max_pending=1)
+        self._dial_pool = dial_pool
+        self._dial = None  # pending dial (a Future) whose result is not yet written
+        self._immediate_dials = set()  # dials answered already, until they are done
+
+        # everything read and written is recorded, if there is a trace path
+        # (see session_trace)
+        self._trace = None
+        if trace is not None:
+            self._trace = TraceWriter(trace, name=name, dial_result=dial_result)
+
+        # the metrics of this modem, looked up once
+        self._port_label = '' if name is None else str(name)
+        self._received_bytes = _RECEIVED_BYTES.labels(self._port_label)
+        self._sent_bytes = _SENT_BYTES.labels(self._port_label)
+        self._result_counts = {result: _RESULTS.labels(self._port_label,
+                                                       result.name.replace('_', ' '))
+                               for result in _ModemResult}
+
         self._serial_port.timeout = None
 
         self._state = _ModemState.COMMAND
 
-        self._command_buffer = b''
+        # command line editor: characters received so far on the current line
+        self._line = bytearray(_LINE_BUFSIZE)
+        self._line_view = memoryview(self._line)
+        self._line_length = 0
+
+        # data read in ONLINE state is only scanned for escapes, never kept
+        self._read_buffer = bytearray(_BUFSIZE)
+        self._read_view = memoryview(self._read_buffer)
 
         self._last_data_read = 0.0
         self._escape_chars_read = 0
+        self._escape_deadline = None    # when a complete escape sequence takes effect
 
         self._current_s_register = None
         self._s = {}
 
+        # everything to be written to the serial port, written at once at
+        # the end of each pass (see _flush_output)
+        self._output = bytearray()
+        self._result_codes = None       # see _update_result_codes
+        self._response_framing = None
+
         self._command_mode_echo = True
         self._verbose_results = True
         self._result_code_suppression = False
@@ -94,6 +176,7 @@ class Modem:
             # but are common in init strings. We define and ignore them.
             0:0, 1:0, 6:0, 7:0, 9:0, 10:0, 11:0
             }
+        self._update_result_codes()
 
     @property
     def escape(self):
@@ -126,75 +209,171 @@ class Modem:
 
 
     def _set_state(self, state):
+        if state is not self._state:
+            _STATE_TRANSITIONS.labels(self._port_label, self._state.name.lower(),
+                                      state.name.lower()).inc()
         self._state = state
 
 
+    # Result codes as written, for each combination of verbose results (V),
+    # line termination (S3) and response formatting (S4) character that
+    # has been used, shared by all modems
+    _result_code_tables = {}
+
+
+    def _update_result_codes(self):
+        # picks the result codes for the current V, S3 and S4, called
+        # whenever one of them may have changed
+        key = (bool(self._verbose_results), self._s[3], self._s[4])
+        table = Modem._result_code_tables.get(key)
+        if table is None:
+            verbose, cr, lf = key[0], _bchr(key[1]), _bchr(key[2])
+            if verbose:
+                codes = {result: cr + lf + _tobstr(result.name.replace('_', ' ')) + cr + lf
+                         for result in _ModemResult}
+                framing = (cr + lf, cr + lf)
+            else:
+                codes = {result: _tobstr(result.value) + cr for result in _ModemResult}
+                framing = (b'', cr + lf)
+            table = Modem._result_code_tables[key] = (codes, framing)
+        self._result_codes, self._response_framing = table
+
+
+    def _write(self, data):
+        self._output += data
+
+
+    def _flush_output(self):
+        # writes everything collected since the last flush, in one write
+        if self._output:
+            self._sent_bytes.inc(len(self._output))
+            if self._trace is not None:
+                self._trace.record(SENT, time.monotonic(), self._output)
+            self._serial_port.write(self._output)
+            self._output.clear()
+
+
     def _write_command_result(self, result):
-        result_name = result.name.replace('_', ' ')
-        self._response_log(result_name)
-        if self._verbose_results:
-            self._serial_port.write(
-                self.carriage_return + self.line_feed +
-                _tobstr(result_name) +
-                self.carriage_return + self.line_feed)
-        else:
-            self._serial_port.write(
-                _tobstr(str(result.value)) +
-                self.carriage_return)
+        self._response_log(result.name.replace('_', ' '))
+        self._result_counts[result].inc()
+        self._output += self._result_codes[result]
 
 
     def _write_command_response(self, response):
         assert isinstance(response, bytes)
         self._response_log(response.strip().decode('cp437'))
-        if self._verbose_results:
-            self._serial_port.write(self.carriage_return + self.line_feed +
-                                    response +
-                                    self.carriage_return + self.line_feed)
-        else:
-            self._serial_port.write(response + self.carriage_return + self.line_feed)
+        prefix, suffix = self._response_framing
+        self._output += prefix
+        self._output += response
+        self._output += suffix
 
 
     def _read_serial(self):
-        # pylint: disable=too-many-branches
+        if self._escape_deadline is not None:
+            self._check_deadlines(time.monotonic())
+        if self._state is _ModemState.ONLINE:
+            return self._read_online_data()
         buf = self._serial_port.read(self._serial_port.in_waiting or 1)
         now = time.monotonic()
+        self._received(buf, len(buf), now)
+        self._receive(buf, now)
+        return len(buf)
+
+
+    def _read_online_data(self):
+        # Fast path for ONLINE state, where everything read is thrown away:
+        # read into the same buffer every time, and only look closer at the
+        # data if it may be (part of) an escape sequence
+        length = self._readinto()
+        now = time.monotonic()
+        self._received(self._read_view, length, now)
+        if self._escape_deadline is not None and now >= self._escape_deadline:
+            # the guard time ran out while waiting, so this is a command
+            self._receive(bytes(self._read_view[:length]), now)
+        elif length > 3 and not self._escape_chars_read:
+            # the usual case: just data, thrown away
+            self._last_data_read = now
+        else:
+            self._online_data(self._read_buffer, length, now)
+        return length
+
+
+    def _readinto(self):
+        # reads what is waiting (at least one byte, at most _BUFSIZE) into
+        # self._read_buffer, returns how many bytes
+        size = self._serial_port.in_waiting
+        if size >= _BUFSIZE:
+            return self._serial_port.readinto(self._read_view)
+        return self._serial_port.readinto(self._read_view[:size or 1])
+
+
+    def _received(self, data, length, now):
+        # counts (and traces) the first `length` bytes of `data`, read from
+        # the serial port at time `now`
+        if length:
+            self._received_bytes.inc(length)
+            if self._trace is not None:
+                self._trace.record(RECEIVED, now, data[:length])
+
+
+    def _receive(self, buf, now):
+        # handles data read from the serial port at time `now`
+        self._check_deadlines(now)
         if self._state == _ModemState.ONLINE:
-            if self._escape_chars_read == 3:
-                if now - self._last_data_read > self.escape_wait:
-                    self._set_state(_ModemState.ONLINE_COMMAND)
-                    self._write_command_result(_ModemResult.NO_CARRIER)
-                    self._escape_chars_read = 0
-                    self._command_buffer += buf
-                elif buf != b'':
-                    # any data read is thrown away, this isn't a real modem
-                    self._escape_chars_read = 0
-                    self._last_data_read = now
-            elif self._escape_chars_read > 0:
-                if (self._escape_chars_read == 1 and buf in [self.escape, self.escape * 2] or
-                        self._escape_chars_read == 2 and buf == self.escape):
-                    self._escape_chars_read += len(buf)
-                    self._last_data_read = now
-                elif buf != b'':
-                    # any data read is thrown away, this isn't a real modem
-                    self._escape_chars_read = 0
-                    self._last_data_read = now
-            elif (now - self._last_data_read > self.escape_wait and
-                  buf in [self.escape, self.escape * 2, self.escape * 3]):
-                self._escape_chars_read = len(buf)
-                self._last_data_read = now
-            elif buf != b'':
-                # any data read is thrown away, this isn't a real modem
-                self._last_data_read = now
+            self._online_data(buf, len(buf), now)
         elif self._state in [_ModemState.COMMAND, _ModemState.ONLINE_COMMAND]:
             if buf != b'':
-                self._command_buffer += buf
                 if self._command_mode_echo:
-                    if _bchr(buf[-1]) == self.carriage_return:
-                        self._serial_port.write(buf + self.line_feed)
-                    else:
-                        self._serial_port.write(buf)
+                    self._output += buf
+                    if buf[-1] == self._s[3]:
+                        self._output.append(self._s[4])
+                self._edit_command_line(buf)
+
+
+    def _online_data(self, data, length, now):
+        # handles the first `length` bytes of `data`, read in ONLINE state
+        # at time `now`. An escape sequence is three escape characters (S2)
+        # with the guard time (S12) before and after, so a chunk can only
+        # be part of one if it is short enough to fit in what remains of
+        # it, and has nothing but escape characters.
+        count = self._escape_chars_read
+        if length > 3 - count:
+            # any data read is thrown away, this isn't a real modem
+            self._last_data_read = now
+            if count:
+                self._escape_chars_read_at(0, now)
+        elif length == 0:
+            pass
+        elif (data.count(self._s[2], 0, length) == length and
+              (count > 0 or now - self._last_data_read > self.escape_wait)):
+            self._escape_chars_read_at(count + length, now)
+        else:
+            self._escape_chars_read_at(0, now)
 
-        return len(buf)
+
+    def _escape_chars_read_at(self, count, now):
+        # `count` escape characters in a row have been read, the last data at
+        # time `now`. Once there are three, and nothing follows within the
+        # guard time (S12), the modem goes to command mode.
+        self._escape_chars_read = count
+        self._last_data_read = now
+        self._escape_deadline = now + self.escape_wait if count == 3 else None
+        self._deadlines_changed()
+
+
+    def _check_deadlines(self, now):
+        # does whatever was due by time `now`
+        if self._escape_deadline is not None and now >= self._escape_deadline:
+            self._escape_deadline = None
+            self._escape_chars_read = 0
+            self._set_state(_ModemState.ONLINE_COMMAND)
+            self._write_command_result(_ModemResult.NO_CARRIER)
+
+
+    def _deadlines_changed(self):
+        # called when the next deadline changes, the blocking modem finds
+        # it again in run_once
+        pass
 
 
     def run(self):
@@ -205,34 +384,71 @@ class Modem:
 
     def run_once(self):
         """does one pass of the inner loop for running the modem"""
+        timeout = self._read_timeout()
+        if self._serial_port.timeout != timeout:
+            self._serial_port.timeout = timeout
         self._read_serial()
-        if self._state == _ModemState.COMMAND:
-            self._process_command_buffer()
-        elif self._state == _ModemState.ONLINE_COMMAND:
-            self._process_command_buffer()
-        elif self._state == _ModemState.ONLINE:
-            pass
-        else:
-            assert False, "Illegal value of Modem._state"
-
-
-    def _process_command_buffer(self):
-        while self.carriage_return in self._command_buffer:
-            eol = self._command_buffer.find(self.carriage_return)
-            line = self._command_buffer[:eol].strip()
-            self._command_log(line.strip().decode('cp437'))
-            self._command_buffer = self._command_buffer[eol+1:]
-            while self.backspace in line:
-                line = re.sub(b'[^' + self.backspace + b']' + self.backspace, b'', line)
-                line = re.sub(b'^' + self.backspace, b'', line)
-            while line[:3] == b'+++':
-                line = line[3:]
-            if line.strip() == b'':
-                return
-            if matches := re.match(b'^[aA][tT](.*)$', line):
-                self._process_at_commands(matches.group(1).upper())
+        self._finish_dial()
+        self._flush_output()
+
+
+    def _read_timeout(self):
+        # how long run_once may wait for data: forever, unless something
+        # other than received data needs attention
+        timeout = None
+        if self._escape_deadline is not None:
+            timeout = max(self._escape_deadline - time.monotonic(), 0)
+        if self._dial is not None:
+            timeout = _DIAL_POLL_INTERVAL if timeout is None else min(timeout,
+                                                                       _DIAL_POLL_INTERVAL)
+        return timeout
+
+
+    def _edit_command_line(self, data):
+        # Apply received characters to the command line, one run of ordinary
+        # characters at a time. Backspace (S5) removes the last character,
+        # the line terminator (S3) executes the line. Both registers may be
+        # changed by the line just executed, so look them up again after it.
+        data_view = memoryview(data)
+        pos = 0
+        eol = None
+        while pos < len(data) and self._state != _ModemState.ONLINE:
+            # once online, the rest is data, and thrown away
+            if eol is None:
+                eol = data.find(self._s[3], pos)
+            end = len(data) if eol < 0 else eol
+            backspace = data.find(self._s[5], pos, end)
+            if backspace >= 0:
+                end = backspace
+
+            count = min(end - pos, _LINE_BUFSIZE - self._line_length)
+            self._line[self._line_length:self._line_length + count] = data_view[pos:pos + count]
+            self._line_length += count
+
+            if backspace >= 0:
+                self._line_length = max(self._line_length - 1, 0)
+                pos = backspace + 1
+            elif eol >= 0:
+                line = self._line_view[:self._line_length]
+                self._line_length = 0
+                self._process_command_line(line)
+                pos = eol + 1
+                eol = None
             else:
-                self._write_command_result(_ModemResult.ERROR)
+                pos = len(data)
+
+
+    def _process_command_line(self, line):
+        line = Modem._strip.match(line).group(1)
+        self._command_log(line.decode('cp437'))
+        while line[:3] == b'+++':
+            line = line[3:]
+        if line.strip() == b'':
+            return
+        if matches := Modem._at_prefix.match(line):
+            self._process_at_commands(matches.group(1).upper())
+        else:
+            self._write_command_result(_ModemResult.ERROR)
 
 
     @staticmethod
@@ -256,6 +472,16 @@ class Modem:
         if value != 0:
             raise ValueError('ATH: value must be 0')
         assert value == 0
+        if self._dial is not None:
+            # a dial that has already started can't be stopped, but its
+            # result is thrown away
+            self._dial.cancel()
+            self._dial = None
+            self._response_log('dial cancelled')
+        for dial in list(self._immediate_dials):
+            # only dials still waiting in the pool can be stopped
+            if dial.cancel():
+                self._response_log('dial cancelled')
         if self._state == _ModemState.ONLINE:
             self._set_state(_ModemState.COMMAND)
             return _ModemResult.NO_CARRIER
@@ -289,6 +515,7 @@ class Modem:
         if value not in [0,1]:
             raise ValueError('ATV: value must be 0 or 1')
         self._verbose_results = value
+        self._update_result_codes()
         return _ModemResult.OK
 
 
@@ -303,6 +530,8 @@ class Modem:
         if not 0 <= value <= 255:
             raise ValueError('AT=: value must be between 0 and 255')
         self._s[self._current_s_register] = value
+        if self._current_s_register in (3, 4):
+            self._update_result_codes()
         return _ModemResult.OK
 
 
@@ -327,52 +556,112 @@ class Modem:
     _commands[b'V'] = _command_atv
     _commands[b'X'] = _command_nop(range(5))
     _commands[b'Z'] = _command_atz
-    _commands[b'\\='] = _command_at_equals
-    _commands[b'\\?'] = _command_at_question
+    _commands[b'='] = _command_at_equals
+    _commands[b'?'] = _command_at_question
+
+    # One compiled pattern for every token the command line may contain,
+    # built once from _commands. Alternatives (by group):
+    #   1, 2: single character command from _commands, with optional number
+    #   3:    D (dial), which must consume the rest of the line
+    #   none: +++ (with leading whitespace), ignored when already in command mode
+    _command_token = re.compile(
+        b'([' + b''.join(re.escape(name) for name in _commands) + b'])(\\d*)|'
+        b'D[PT]?(\\s*\\+?[\\d\\s]+)\\;?$|'
+        b'\\s*\\+\\+\\+')
+    _whitespace = re.compile(b'\\s')
+    _strip = re.compile(b'\\s*(.*?)\\s*$', re.DOTALL)
+    _at_prefix = re.compile(b'[aA][tT](.*)$')
 
 
     def _process_at_commands(self, line):
         result = _ModemResult.OK
-        while line != b'' and result == _ModemResult.OK:
-
-            # ignore whitespace and +++ when already in command mode
-            if matches:= re.match(b'\\s*\\+\\+\\+(.*)$', line):
-                line = matches.group(1).strip
+        pos = 0
+        while pos < len(line) and result == _ModemResult.OK:
+            matches = Modem._command_token.match(line, pos)
+            if matches is None:
+                # unknown command
+                result = _ModemResult.ERROR
+                break
+            pos = matches.end()
 
             # Handle most of the supported AT-commands
-            break_out = False
-            for cmd_name, cmd_func in Modem._commands.items():
-                if matches := re.match(cmd_name + b'(\\d*)(.*)$', line):
-                    break_out = True
-                    param = _int0(matches.group(1))
-                    line = matches.group(2)
-                    try:
-                        result = cmd_func(self, param)
-                    except (ValueError, NotImplementedError):
-                        result = _ModemResult.ERROR
-                    break
-            if break_out:
-                continue
-
-            # D: dial a number
-            if matches := re.match(b'D[PT]?(\\s*\\+?[\\d\\s]+)\\;?$', line):
-                number = re.sub(b'\\s', b'', matches.group(1))
-                line = b''
-
+            if matches.group(1) is not None:
+                cmd_func = Modem._commands[matches.group(1)]
+                param = _int0(matches.group(2))
                 try:
-                    self._dialer.dial(number.decode('ascii'))
+                    result = cmd_func(self, param)
                 except (ValueError, NotImplementedError):
                     result = _ModemResult.ERROR
 
-                # no CONNECT for voice calls, this isn't a real modem
+            # D: dial a number
+            elif matches.group(3) is not None:
+                number = Modem._whitespace.sub(b'', matches.group(3))
+                pos = len(line)
+                result = self._start_dial(number.decode('ascii'))
+                if result is None:
+                    return  # the result is written when the dial is done
 
-            # otherwise: unknown command
-            else:
-                result = _ModemResult.ERROR
-                break
+                # no CONNECT for voice calls, this isn't a real modem
 
         self._write_command_result(result)
 
+
+    def _start_dial(self, number):
+        # returns the result code, or None when it is deferred
+        if self._dial_result == 'inline':
+            # the dial may take a while, show the echo first
+            self._flush_output()
+            try:
+                self._dialer.dial(number)
+            except Exception as exception: # pylint: disable=broad-except
+                # not only bad numbers: the dialer may time out, or be refused
+                logging.getLogger('dial').error('dialing failed: %r', exception)
+                return _ModemResult.ERROR
+            return _ModemResult.OK
+
+        if self._dial is not None:
+            return _ModemResult.BUSY
+        dial = self._dial_pool.submit(self._dialer, number)
+        if dial is None:
+            return _ModemResult.BUSY
+        if self._dial_result == 'immediate':
+            dial.add_done_callback(self._log_dial_failure)
+            self._immediate_dials.add(dial)
+            dial.add_done_callback(self._immediate_dials.discard)
+            return _ModemResult.OK
+        self._dial = dial
+        self._dial_started(dial)
+        return None
+
+
+    def _dial_started(self, dial): # pylint: disable=unused-argument
+        # called with the Future of a deferred dial, the blocking modem
+        # polls it from run_once
+        pass
+
+
+    def _finish_dial(self):
+        # writes the result of a deferred dial, once it is done
+        if self._dial is None or not self._dial.done():
+            return
+        dial, self._dial = self._dial, None
+        if self._log_dial_failure(dial):
+            self._write_command_result(_ModemResult.ERROR)
+        else:
+            self._write_command_result(_ModemResult.OK)
+
+
+    @staticmethod
+    def _log_dial_failure(dial):
+        # logs why a finished dial failed, returns True if it did
+        if dial.cancelled():
+            return True
+        exception = dial.exception()
+        if exception is not None:
+            logging.getLogger('dial').error('dialing failed: %r', exception)
+            return True
+        return False
+
 if __name__ == "__main__":
 
     from init_serial import init_serial
@@ -1,40 +1,165 @@
 """Dialing with Phonelog (other project)"""
+import functools
 import json
 import logging
+import threading
+import time
 
 import requests
 
-from console_user import console_user_email_and_phone
-from e164 import to_e164
+from console_user import IdentityCache, directory_identity
+import directory
+from directory_index import DirectoryIndex
+from e164 import ImpossibleNumber, to_e164
 from init_serial import init_serial
+import metrics
 import modem
 
+_DIALS = metrics.counter('phonelog_dials_total',
+                         'Dials, by outcome (success, impossible, error)', ('outcome',))
+_DIAL_SECONDS = metrics.histogram('phonelog_dial_seconds',
+                                  'Time to dial, from the number to the answer from Phonelog')
+_DIAL_STAGE_SECONDS = metrics.histogram('phonelog_dial_stage_seconds',
+                                        'Time spent on each stage of a dial: e164 (the number),'
+                                        ' identity (the console user and the directory, when'
+                                        ' not cached) and http (Phonelog)', ('stage',))
+_E164_SECONDS = _DIAL_STAGE_SECONDS.labels('e164')
+_IDENTITY_SECONDS = _DIAL_STAGE_SECONDS.labels('identity')
+_HTTP_SECONDS = _DIAL_STAGE_SECONDS.labels('http')
+
 class PhoneLogDialer:
     """PhoneLogDialer provides a method dial() to dial a phone number in E164-format"""
+    # pylint: disable=too-many-instance-attributes
     def __init__(self):
         with open('phonelog.json', encoding="utf-8") as json_file:
             data = json.load(json_file)
 
-        self._api_url = f"https://{data['hostname']}/api/dial"
+        # "scheme" and "verify" (a CA bundle, or false) are for testing
+        # against a local stand-in, see phonelog_standin.py
+        self._base_url = f"{data.get('scheme', 'https')}://{data['hostname']}/"
+        self._api_url = f"{self._base_url}api/dial"
         self._auth = (data['username'], data['password'])
         self._country_code = data.get('country_code', '')
         self._local_code = data.get('local_prefix', '')
+        self._timeout = (data.get('connect_timeout', 3.05),
+                         data.get('read_timeout', 10))
+        self._keepalive_interval = data.get('keepalive_interval', 50)
+        # per request, as REQUESTS_CA_BUNDLE would override it on the session
+        self._verify = data.get('verify', True)
+
+        # One session, and so one pool of keep-alive connections, for all
+        # dials, however many threads they run in
+        self._session = requests.Session()
+        self._session.auth = self._auth
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=data.get('pool_size', 4))
+        self._session.mount(self._base_url, adapter)
+
+        # where users are looked up: Active Directory through COM (the
+        # default), or any LDAP server, e.g. {"backend": "ldap", "server": ...}
+        if 'directory' in data:
+            directory.set_backend(directory.backend_from_config(data['directory']))
+
+        # who is dialing, kept current in the background, looked up in a
+        # local copy of the directory when there is one
+        resolver = functools.partial(directory_identity,
+                                     country_code=self._country_code,
+                                     local_code=self._local_code)
+        self._directory = None
+        index_path = data.get('directory_index')
+        if index_path:
+            self._directory = DirectoryIndex(index_path,
+                                             self._country_code,
+                                             self._local_code,
+                                             data.get('directory_full_sync_interval', 86400))
+            self._directory.start(data.get('directory_sync_interval', 300),
+                                  initializer=self.initialize_thread)
+            resolver = self._directory.identity
+        self._identity = IdentityCache(
+            resolver=resolver,
+            ttl=data.get('identity_ttl', 300),
+            poll_interval=data.get('identity_poll_interval', 5),
+            initializer=self.initialize_thread).start()
+
+        self._last_used = 0.0
+        self._stopped = threading.Event()
+        if self._keepalive_interval:
+            threading.Thread(target=self._keep_warm, name='phonelog-warmer',
+                             daemon=True).start()
+
+
+    def close(self):
+        """stops keeping the connections warm, and closes them"""
+        self._identity.stop()
+        if self._directory is not None:
+            self._directory.stop()
+        self._stopped.set()
+        self._session.close()
+
+
+    def _warm(self):
+        # connect (DNS, TCP and TLS) ahead of the next dial
+        self._last_used = time.monotonic()
+        try:
+            self._session.head(self._base_url, timeout=self._timeout, verify=self._verify)
+        except requests.RequestException as exc:
+            logging.getLogger('phonelog').warning('could not reach Phonelog: %r', exc)
+
+
+    def _keep_warm(self):
+        # warms the connection at startup, and whenever it has been idle long
+        # enough that the server may have closed it
+        self._warm()
+        while not self._stopped.wait(self._keepalive_interval):
+            if time.monotonic() - self._last_used >= self._keepalive_interval:
+                self._warm()
+
+
+    @staticmethod
+    def initialize_thread():
+        """prepares a thread other than the main thread for dialing"""
+        # Active Directory lookups use COM, and every dialing thread joins
+        # the multithreaded apartment; other backends need nothing
+        initialize = getattr(directory.backend(), 'initialize_thread', None)
+        if initialize is not None:
+            initialize()
 
 
     def dial(self, to_number):
-        """dials a phone number in E164 format"""
-        email, phone_fallback = console_user_email_and_phone(self._country_code,
-                                                             self._local_code)
+        """dials a phone number in E164 format; raises ImpossibleNumber,
+        without asking Phonelog, if it can't be dialed"""
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            self._dial(to_number)
+            outcome = 'success'
+        except ImpossibleNumber:
+            outcome = 'impossible'
+            raise
+        finally:
+            _DIALS.labels(outcome).inc()
+            _DIAL_SECONDS.observe(time.perf_counter() - start)
+
+
+    def _dial(self, to_number):
+        start = time.perf_counter()
+        to_number = to_e164(to_number, self._country_code, self._local_code)
+        converted = time.perf_counter()
+        _E164_SECONDS.observe(converted - start)
+        # the operator's own number is E.164 already, or None if the
+        # directory has none that can be dialed, which leaves it out
+        _, email, phone_fallback = self._identity.get()
+        identified = time.perf_counter()
+        _IDENTITY_SECONDS.observe(identified - converted)
         params = {'operator_email': email,
-                  'operator_fallback_number': to_e164(phone_fallback,
-                                                      self._country_code,
-                                                      self._local_code),
-                  'to_number': to_e164(to_number,
-                                       self._country_code,
-                                       self._local_code)}
-        response = requests.post(self._api_url,
-                                auth=self._auth,
-                                params=params)
+                  'operator_fallback_number': phone_fallback,
+                  'to_number': to_number}
+        self._last_used = time.monotonic()
+        response = self._session.post(self._api_url,
+                                      params=params,
+                                      timeout=self._timeout,
+                                      verify=self._verify)
+        _HTTP_SECONDS.observe(time.perf_counter() - identified)
         if response.status_code != 200:
             raise RuntimeError(f"Phonelog API returned status code {response.status_code}")
         result = response.text
@@ -0,0 +1,281 @@
+"""a stand-in for the Phonelog API (run: python phonelog_standin.py --help)
+
+Answers POST /api/dial the way Phonelog does: basic auth, the
+operator_email, operator_fallback_number and to_number parameters, and
+'success\\n' as the body. HEAD / (the dialer keeping its connections warm)
+is answered too. Everything runs locally, over HTTP or, given a
+certificate, HTTPS, so the dialer can be measured without a network.
+
+Faults may be injected into the dials: a latency drawn from a
+distribution, error statuses, 'success' that isn't, responses that stall
+after the headers, and connections reset without a response.
+
+To point PhoneLogDialer at it, set "hostname" in phonelog.json to the
+stand-in's host:port, and "scheme" to "http" unless it runs with TLS
+("verify" may name its certificate).
+"""
+import argparse
+import base64
+import collections
+import http.server
+import random
+import re
+import socket
+import ssl
+import struct
+import threading
+import time
+import urllib.parse
+
+_E164 = re.compile(r'\+[1-9]\d{1,14}$')
+
+
+def latency_distribution(spec):
+    """Returns a function of a random.Random giving a latency in seconds,
+    from a spec like '0.05' (fixed), 'uniform:0.02:0.2',
+    'exp:0.05' (mean) or 'lognormal:0.05:0.8' (median, sigma)"""
+    kind, _, args = spec.partition(':')
+    try:
+        if not args:
+            seconds = float(kind)
+            return lambda rng: seconds
+        args = [float(arg) for arg in args.split(':')]
+        if kind == 'uniform':
+            low, high = args
+            return lambda rng: rng.uniform(low, high)
+        if kind == 'exp':
+            mean, = args
+            return lambda rng: rng.expovariate(1 / mean) if mean else 0.0
+        if kind == 'lognormal':
+            median, sigma = args
+            return lambda rng: median * rng.lognormvariate(0, sigma)
+    except ValueError:
+        pass
+    raise ValueError(f"bad latency '{spec}', e.g. 0.05, uniform:0.02:0.2, exp:0.05"
+                     " or lognormal:0.05:0.8")
+
+
+class Faults:
+    """What can go wrong with a dial, and how often
+
+    Every dial waits for a latency from `latency` (see latency_distribution),
+    then has one outcome, drawn with the given rates: the connection is
+    reset without a response, the status is `error_status`, the body is
+    not 'success', the body comes `slow_seconds` after the headers, or it
+    succeeds.
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, latency='0', error_rate=0.0, error_status=503, fail_rate=0.0,
+                 slow_rate=0.0, slow_seconds=30.0, reset_rate=0.0, seed=None):
+        self.latency = latency_distribution(latency)
+        self.error_status = error_status
+        self.slow_seconds = slow_seconds
+        self._outcomes = [('reset', reset_rate), ('error', error_rate),
+                          ('fail', fail_rate), ('slow', slow_rate)]
+        if sum(rate for _, rate in self._outcomes) > 1:
+            raise ValueError('the fault rates add up to more than 1')
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+
+    def draw(self):
+        """Returns the latency and the outcome of one dial"""
+        with self._lock:
+            latency = self.latency(self._random)
+            draw = self._random.random()
+        for outcome, rate in self._outcomes:
+            if draw < rate:
+                return latency, outcome
+            draw -= rate
+        return latency, 'success'
+
+
+class _DialHandler(http.server.BaseHTTPRequestHandler):
+    """Answers one connection to the stand-in, keeping it alive like Phonelog"""
+    protocol_version = 'HTTP/1.1'
+    server_version = 'PhonelogStandIn'
+    # headers and body in one segment, or the client's delayed ACK adds 40 ms
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+    def do_HEAD(self): # pylint: disable=invalid-name
+        """the dialer warming its connections"""
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """a dial"""
+        url = urllib.parse.urlsplit(self.path)
+        # a request body is not expected, but must not be left unread
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if url.path != '/api/dial':
+            self._respond(404, b'not found\n', 'not found')
+            return
+        if self.headers.get('Authorization') != self.server.authorization:
+            self._respond(401, b'unauthorized\n', 'unauthorized',
+                          [('WWW-Authenticate', 'Basic realm="Phonelog"')])
+            return
+        params = urllib.parse.parse_qs(url.query)
+        to_number = params.get('to_number', [''])[0]
+        fallback = params.get('operator_fallback_number', [None])[0]
+        if not _E164.match(to_number) or fallback is not None and not _E164.match(fallback):
+            self._respond(400, b'bad request\n', 'bad request')
+            return
+
+        latency, outcome = self.server.faults.draw()
+        if latency:
+            time.sleep(latency)
+        if outcome == 'reset':
+            self._reset()
+        elif outcome == 'error':
+            self._respond(self.server.faults.error_status, b'error\n', outcome)
+        elif outcome == 'fail':
+            self._respond(200, b'failure\n', outcome)
+        elif outcome == 'slow':
+            self._respond(200, b'success\n', outcome, stall=self.server.faults.slow_seconds)
+        else:
+            self._respond(200, b'success\n', outcome)
+
+
+    def _respond(self, status, body, outcome, headers=(), stall=0.0):
+        # pylint: disable=too-many-arguments
+        self.server.count(outcome)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if stall:
+            self.wfile.flush()
+            time.sleep(stall)
+        self.wfile.write(body)
+
+
+    def _reset(self):
+        # closing with a zero linger time sends RST instead of FIN
+        self.server.count('reset')
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.connection.close()
+        self.close_connection = True
+
+
+class PhonelogStandIn(http.server.ThreadingHTTPServer):
+    """A local Phonelog API, with faults injected
+
+    `faults` is a Faults, with none by default. With a `certfile` (and a
+    `keyfile`, unless the key is in the certfile) it serves HTTPS.
+    """
+    daemon_threads = True
+    request_queue_size = 128    # the default 5 drops connections under load
+    # pylint: disable=too-many-arguments
+    def __init__(self, address=('127.0.0.1', 0), username='', password='', faults=None,
+                 certfile=None, keyfile=None, verbose=False):
+        super().__init__(address, _DialHandler)
+        credentials = base64.b64encode(f'{username}:{password}'.encode('utf-8'))
+        self.authorization = f"Basic {credentials.decode('ascii')}"
+        self.faults = faults or Faults()
+        self.verbose = verbose
+        self.scheme = 'http'
+        self.certfile = certfile
+        if certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            # the handshake happens in the connection's own thread
+            self.socket = context.wrap_socket(self.socket, server_side=True,
+                                              do_handshake_on_connect=False)
+            self.scheme = 'https'
+        self._counts = collections.Counter()
+        self._counts_lock = threading.Lock()
+        self._thread = None
+
+
+    @property
+    def hostname(self):
+        """host:port, as "hostname" in phonelog.json"""
+        host, port = self.server_address[:2]
+        return f'{host}:{port}'
+
+
+    def count(self, outcome):
+        """counts a response"""
+        with self._counts_lock:
+            self._counts[outcome] += 1
+
+
+    def counts(self):
+        """Returns the number of responses of each outcome so far"""
+        with self._counts_lock:
+            return dict(self._counts)
+
+
+    def start(self):
+        """starts serving in the background"""
+        self._thread = threading.Thread(target=self.serve_forever, name='phonelog-standin',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        """stops serving, and closes the listening socket"""
+        self.shutdown()
+        self.server_close()
+        self._thread = None
+
+
+    def handle_error(self, request, client_address):
+        # clients giving up on slow responses are part of the game
+        if self.verbose:
+            super().handle_error(request, client_address)
+
+
+def main():
+    """runs the stand-in until interrupted"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--username', default='workstation33')
+    parser.add_argument('--password', default='sEcReT!')
+    parser.add_argument('--latency', default='0',
+                        help='0.05, uniform:0.02:0.2, exp:0.05 or lognormal:0.05:0.8 (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help="fraction of dials answered with something other than 'success'")
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help='fraction of dials that stall between headers and body')
+    parser.add_argument('--slow-time', type=float, default=30.0,
+                        help='seconds a slow response stalls')
+    parser.add_argument('--reset-rate', type=float, default=0.0,
+                        help='fraction of dials where the connection is reset')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--certfile', help='serve HTTPS with this certificate')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    faults = Faults(args.latency, args.error_rate, args.error_status, args.fail_rate,
+                    args.slow_rate, args.slow_time, args.reset_rate, args.seed)
+    server = PhonelogStandIn((args.host, args.port), args.username, args.password, faults,
+                             args.certfile, args.keyfile, args.verbose)
+    print(f"Phonelog stand-in at {server.scheme}://{server.hostname}/api/dial")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"responses: {server.counts()}")
+
+
+if __name__ == "__main__":
+    main()
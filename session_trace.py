@@ -0,0 +1,252 @@
+"""record modem sessions, and replay them (run: python session_trace.py --help)
+
+A Modem given a trace path (or "trace" in serial.json) records every
+chunk it reads from and writes to the serial port, with the time, in a
+compact binary file:
+
+    b'MDMTRACE', version (1 byte), metadata length (4 bytes), metadata (JSON),
+    then per chunk: direction (1 byte), microseconds since the start
+    (8 bytes), length (4 bytes), the bytes
+
+Records are written by a thread of their own, so recording costs the
+modem little more than a queue put per chunk.
+
+A replay feeds what was read back to a new Modem over a pseudo terminal
+(not Windows), with the recorded timing, at 1x or N times the speed, and
+compares what it writes with what was recorded. At N times the speed the
+modem's guard time (S12) is N times shorter too, so escapes still work.
+Replays also make benchmarks: with a high speed the report shows how far
+the output lags behind the recorded timing.
+
+A replay sends each input at its recorded time; it doesn't wait for the
+output recorded before it. Input that came faster than the modem could
+answer (a dialing program that sends its next line microseconds after
+the last reply) may overtake that reply in a replay, and the output then
+differs even from an unchanged modem. Sessions with a pause between
+commands replay exactly.
+"""
+import argparse
+import atexit
+import bisect
+import difflib
+import json
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+RECEIVED = 0    # read from the serial port
+SENT = 1        # written to the serial port
+
+_MAGIC = b'MDMTRACE'
+_VERSION = 1
+_HEADER = struct.Struct('<BI')
+_RECORD = struct.Struct('<BQI')
+
+
+class TraceWriter:
+    """Records chunks to a trace file, in a background thread"""
+    def __init__(self, path, **metadata):
+        # pylint: disable=consider-using-with
+        self._file = open(path, 'wb')
+        metadata = json.dumps(dict(metadata, started=time.time())).encode('utf-8')
+        self._file.write(_MAGIC + _HEADER.pack(_VERSION, len(metadata)) + metadata)
+        self._start = time.monotonic()
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+
+    def record(self, direction, now, data):
+        """records `data`, read or written (`direction`) at time.monotonic() `now`"""
+        self._queue.put((direction, now, bytes(data)))
+
+
+    def close(self):
+        """writes what is left, and closes the file"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+            atexit.unregister(self.close)
+
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            direction, now, data = item
+            microseconds = max(0, round((now - self._start) * 1e6))
+            self._file.write(_RECORD.pack(direction, microseconds, len(data)))
+            self._file.write(data)
+            if self._queue.empty():
+                # nothing more for now, so what there is may as well be on disk
+                self._file.flush()
+
+
+def read_trace(path):
+    """Returns the metadata of a trace, and a list of its records:
+    (direction, seconds since the start, bytes)"""
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(_MAGIC):
+        raise ValueError(f'{path} is not a modem trace')
+    offset = len(_MAGIC)
+    version, length = _HEADER.unpack_from(data, offset)
+    if version != _VERSION:
+        raise ValueError(f'{path}: trace version {version}, expected {_VERSION}')
+    offset += _HEADER.size
+    metadata = json.loads(data[offset:offset + length].decode('utf-8'))
+    offset += length
+    records = []
+    # a trace cut short (the modem was killed) is read as far as it goes
+    while offset + _RECORD.size <= len(data):
+        direction, microseconds, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        records.append((direction, microseconds / 1e6, data[offset:offset + length]))
+        offset += length
+    return metadata, records
+
+
+def _replay_modem_class():
+    # pylint: disable=import-outside-toplevel
+    from modem import Modem
+
+    class ReplayModem(Modem):
+        """A Modem whose guard time is `speed` times shorter"""
+        def __init__(self, *args, speed=1.0, **kwargs):
+            self._speed = speed
+            super().__init__(*args, **kwargs)
+
+        @property
+        def escape_wait(self):
+            return super().escape_wait / self._speed
+
+    return ReplayModem
+
+
+class _Output:
+    """Collects what the modem writes, and when, in a thread of its own"""
+    def __init__(self, fd):
+        self._fd = fd
+        self.data = bytearray()
+        self.arrivals = []      # (bytes written so far, time.perf_counter())
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trace-output', daemon=True)
+        self._thread.start()
+
+
+    def _run(self):
+        while not self._stopped.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 0.05)
+            if ready:
+                self.data += os.read(self._fd, 65536)
+                self.arrivals.append((len(self.data), time.perf_counter()))
+
+
+    def stop(self):
+        """stops collecting"""
+        self._stopped.set()
+        self._thread.join()
+
+
+def replay(path, speed=1.0, settle=1.0):
+    """Replays the trace at `path` against a new Modem, `speed` times as
+    fast as it was recorded. Returns what was recorded, what the modem
+    wrote now, and how late each recorded write came in seconds."""
+    # pylint: disable=import-outside-toplevel
+    from testmodem import PtyModem
+
+    metadata, records = read_trace(path)
+    pty_modem = PtyModem(modem_class=_replay_modem_class(), speed=speed,
+                         dial_result=metadata.get('dial_result', 'inline'))
+    output = _Output(pty_modem.port.fileno())
+    expected = bytearray()
+    due = []    # (bytes written so far, when) for each recorded write
+    try:
+        start = time.perf_counter()
+        for direction, seconds, data in records:
+            when = start + seconds / speed
+            if direction == SENT:
+                expected += data
+                due.append((len(expected), when))
+                continue
+            delay = when - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pty_modem.port.write(data)
+        until = max([when for _, when in due] + [time.perf_counter()]) + settle
+        while len(output.data) < len(expected) and time.perf_counter() < until:
+            time.sleep(0.01)
+    finally:
+        output.stop()
+        pty_modem.close()
+
+    ends = [end for end, _ in output.arrivals]
+    lags = []
+    for end, when in due:
+        i = bisect.bisect_left(ends, end)
+        if i < len(ends):
+            lags.append(output.arrivals[i][1] - when)
+    return bytes(expected), bytes(output.data), lags
+
+
+def _lines(data):
+    return [repr(line) for line in data.decode('cp437').splitlines(keepends=True)]
+
+
+def _dump(args):
+    metadata, records = read_trace(args.trace)
+    print(json.dumps(metadata))
+    for direction, seconds, data in records:
+        print(f"{seconds:12.6f} {'<>'[direction]} {data!r}")
+    return 0
+
+
+def _replay(args):
+    # pylint: disable=import-outside-toplevel
+    from testmodem import percentile
+
+    start = time.perf_counter()
+    expected, actual, lags = replay(args.trace, args.speed, args.settle)
+    seconds = time.perf_counter() - start
+    print(f"replayed at {args.speed:g}x in {seconds:.2f} s, {len(expected)} bytes expected,"
+          f" {len(actual)} written; lag ms p50 {percentile(lags, 0.5) * 1000:.2f}"
+          f" p99 {percentile(lags, 0.99) * 1000:.2f}"
+          f" max {max(lags, default=float('nan')) * 1000:.2f}")
+    if expected == actual:
+        print("output matches the trace")
+        return 0
+    sys.stdout.writelines(line + '\n' for line in difflib.unified_diff(
+        _lines(expected), _lines(actual), 'recorded', 'replayed', lineterm=''))
+    return 1
+
+
+def main():
+    """dumps or replays a trace"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help='show the records of a trace')
+    dump.add_argument('trace')
+    dump.set_defaults(run=_dump)
+    replay_parser = commands.add_parser('replay', help='replay a trace, and diff the output')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='how many times faster than recorded')
+    replay_parser.add_argument('--settle', type=float, default=1.0,
+                               help='seconds to wait for output after the last recorded')
+    replay_parser.set_defaults(run=_replay)
+    args = parser.parse_args()
+    if getattr(args, 'speed', 1.0) <= 0:
+        parser.error('--speed must be more than 0')
+    sys.exit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""run some simple tests on the directory lookups (run: python testdirectory.py)
+
+The lookups are tested with stand-ins for the console user and the
+directory, so they run anywhere, without Windows or a domain controller.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+from ldap3.core.exceptions import LDAPException, LDAPSocketOpenError
+
+from console_user import Identity, IdentityCache
+import directory
+from directory_index import DirectoryIndex
+from ldap_directory import LDAPDirectory
+
+
+class _FlakyDirectory:
+    """A resolver for IdentityCache that fails while `failing` is set"""
+    def __init__(self):
+        self.failing = False
+        self.lookups = 0
+        self.phone = '+4722334455'
+
+    def __call__(self, user):
+        self.lookups += 1
+        if self.failing:
+            raise ConnectionError('domain controller unreachable')
+        return Identity(user, f'{user}@example.com', self.phone)
+
+
+def identity_cache_outage():
+    """a failed lookup keeps the last identity found, and is tried again"""
+    user = ['alice']
+    directory = _FlakyDirectory()
+    cache = IdentityCache(session_source=lambda: user[0], resolver=directory,
+                          ttl=0.05, poll_interval=0.01)
+    assert cache.get() == Identity('alice', 'alice@example.com', '+4722334455')
+
+    # the lookup fails when the identity is due for a refresh
+    directory.failing = True
+    time.sleep(0.06)
+    lookups = directory.lookups
+    assert cache.get() == Identity('alice', 'alice@example.com', '+4722334455')
+    assert cache.get() == Identity('alice', 'alice@example.com', '+4722334455')
+    assert directory.lookups == lookups + 2, 'a failed lookup is tried again'
+
+    # and in the background
+    cache.start()
+    try:
+        time.sleep(0.1)
+        assert directory.lookups > lookups + 2, 'the background refresh tries again'
+        assert cache.get().email == 'alice@example.com'
+
+        # once the directory is back, the identity is up to date again
+        directory.phone = '+4722334466'
+        directory.failing = False
+        time.sleep(0.1)
+        assert cache.get() == Identity('alice', 'alice@example.com', '+4722334466')
+
+        # a new user whose lookup fails has no identity yet, but it isn't
+        # kept: the next poll looks the user up again
+        directory.failing = True
+        user[0] = 'bob'
+        time.sleep(0.05)
+        assert cache.get() == Identity('bob', None, None)
+        directory.failing = False
+        time.sleep(0.05)
+        assert cache.get() == Identity('bob', 'bob@example.com', '+4722334466')
+    finally:
+        cache.stop()
+
+
+class _FakeDirectory:
+    """A directory backend with users in a dict, for DirectoryIndex"""
+    _INDEX = {'sAMAccountName': 0, 'mail': 1, 'telephoneNumber': 2, 'uSNChanged': 3}
+
+    def __init__(self):
+        self.users = {}     # sAMAccountName -> (mail, telephoneNumber, uSNChanged)
+        self.usn = 0
+
+
+    def set_user(self, name, mail, phone):
+        """adds or changes a user"""
+        self.usn += 1
+        self.users[name] = (mail, phone, self.usn)
+
+
+    def domain_controller(self):
+        """always the same one"""
+        return 'dc1'
+
+
+    def lookup_users(self, attributes, server=None, changed_since=None):
+        """the users changed since `changed_since`, or all of them"""
+        assert tuple(attributes) == tuple(self._INDEX)
+        return [directory.Record(self._INDEX, (name,) + user)
+                for name, user in self.users.items()
+                if changed_since is None or user[2] > changed_since]
+
+
+def directory_index_deletions():
+    """users deleted or renamed in the directory leave the index at the next full sync"""
+    fake = _FakeDirectory()
+    fake.set_user('alice', 'alice@example.com', '22334455')
+    fake.set_user('bob', 'bob@example.com', '22334466')
+    saved = directory._backend # pylint: disable=protected-access
+    directory.set_backend(fake)
+    with tempfile.TemporaryDirectory() as temporary:
+        try:
+            path = os.path.join(temporary, 'index.json.gz')
+            index = DirectoryIndex(path, '+47', full_sync_interval=3600)
+            assert index.sync() == 2
+            assert index.get('Alice') == ('alice@example.com', '22334455', '+4722334455')
+
+            # bob is renamed, alice deleted: an incremental sync only sees robert
+            fake.users['robert'] = fake.users.pop('bob')
+            fake.set_user('robert', 'bob@example.com', '22334466')
+            del fake.users['alice']
+            assert index.sync() == 1
+            assert index.get('robert') is not None
+            assert index.get('alice') is not None and index.get('bob') is not None
+
+            # a full sync drops them, and so does the saved index
+            assert index.sync(full=True) == 3
+            assert index.get('alice') is None and index.get('bob') is None
+            assert len(DirectoryIndex(path)) == 1
+
+            # the next full sync is due by itself once full_sync_interval has passed
+            index = DirectoryIndex(path, '+47', full_sync_interval=0)
+            fake.users.clear()
+            index.sync()
+            assert len(index) == 0
+        finally:
+            directory.set_backend(saved)
+
+
+_LDAP_ENTRIES = {
+    'CN=Alice,OU=Users,DC=example,DC=com': {
+        'objectClass': ['top', 'person', 'user'], 'objectCategory': 'Person',
+        'sAMAccountName': 'alice', 'cn': 'Alice', 'displayName': 'Alice Example',
+        'mail': 'alice@example.com', 'telephoneNumber': '22334455', 'uSNChanged': '10'},
+    'CN=Bob,OU=Users,DC=example,DC=com': {
+        'objectClass': ['top', 'person', 'user'], 'objectCategory': 'Person',
+        'sAMAccountName': 'bob', 'cn': 'Bob',
+        'mail': 'bob@example.com', 'uSNChanged': '20'},
+}
+
+
+class _BrokenConnection:
+    """An LDAP connection whose searches raise `error`"""
+    def __init__(self, error):
+        self._error = error
+        self.extend = types.SimpleNamespace(standard=types.SimpleNamespace(
+            paged_search=self._paged_search))
+
+
+    def _paged_search(self, *args, **kwargs):
+        raise self._error
+
+
+    def unbind(self):
+        """nothing to close"""
+
+
+def _failing_ldap(error):
+    # a mock LDAPDirectory with a pool of one connection, the first of
+    # which fails with `error`
+    # pylint: disable=protected-access
+    ldap = LDAPDirectory.mock(_LDAP_ENTRIES, pool_size=1, timeout=0.1)
+    connect = ldap._connection_factory
+    errors = [error]
+    ldap._connection_factory = lambda: _BrokenConnection(errors.pop()) if errors else connect()
+    return ldap
+
+
+def ldap_directory_mock():
+    """LDAPDirectory looks users up, doesn't lose pooled connections to errors,
+    and starts without a directory to connect to"""
+    # pylint: disable=protected-access
+    ldap = LDAPDirectory.mock(_LDAP_ENTRIES, pool_size=1, timeout=0.1)
+    assert ldap.lookup_user('alice', ('mail', 'telephoneNumber')).telephoneNumber == '22334455'
+    assert ldap.lookup_user('Alice Example', ('mail',)).mail == 'alice@example.com'
+    assert ldap.lookup_user('carol', ('mail',)) is None
+    found = ldap.find_users(['alice', 'BOB', 'carol'], ('mail',))
+    assert {name: record.mail for name, record in found.items()} == \
+        {'alice': 'alice@example.com', 'BOB': 'bob@example.com'}
+    changed = ldap.lookup_users(('sAMAccountName', 'uSNChanged'), changed_since=15)
+    assert [record.sAMAccountName for record in changed] == ['bob']
+
+    # a connection that fails is replaced, and the search tried again
+    ldap = _failing_ldap(LDAPSocketOpenError('connection reset'))
+    assert ldap.lookup_user('bob', ('mail',)).mail == 'bob@example.com'
+    assert ldap._connections == 1
+
+    # any other error doesn't leave the pool (of one) a connection short
+    ldap = _failing_ldap(RuntimeError('unexpected'))
+    try:
+        ldap.lookup_user('bob', ('mail',))
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'the error is raised'
+    assert ldap._connections == 0
+    assert ldap.lookup_user('bob', ('mail',)).mail == 'bob@example.com'
+
+    # a pool with no connection free in time is an LDAP error too
+    ldap = LDAPDirectory.mock(_LDAP_ENTRIES, pool_size=1, timeout=0.1)
+    connection = ldap._acquire()
+    try:
+        ldap.lookup_user('bob', ('mail',))
+    except LDAPException:
+        pass
+    else:
+        assert False, 'the pool is empty'
+    ldap._release(connection)
+
+    # with the directory down, it can be made, and lookups fail until it is up
+    ldap = LDAPDirectory('127.0.0.1:1', timeout=1)
+    try:
+        ldap.lookup_user('bob', ('mail',))
+    except LDAPException:
+        pass
+    else:
+        assert False, 'there is no directory at 127.0.0.1:1'
+
+
+TESTS = [identity_cache_outage, directory_index_deletions, ldap_directory_mock]
+
+
+def main():
+    """runs the tests, returns the exit status"""
+    # failed lookups are logged, and are expected here
+    logging.disable(logging.CRITICAL)
+    for test in TESTS:
+        try:
+            test()
+        except Exception as exc: # pylint: disable=broad-except
+            print(f"{test.__name__}: failed: {exc!r}")
+            return 1
+        print(f"{test.__name__:>26}: ok")
+    print("Tests completed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""run some simple tests on the E.164 conversion (run: python teste164.py)"""
+import sys
+
+from e164 import ImpossibleNumber, to_e164, to_e164_many
+
+# number, country code, local code, and the E.164 number (None if impossible)
+CASES = [
+    ('22334455', '+47', '', '+4722334455'),
+    ('+47 22 33 44 55', '+47', '', '+4722334455'),
+    ('0046701234567', '+47', '', '+46701234567'),
+    # a 0 for an outside line, where there is no trunk prefix
+    ('022334455', '+47', '', '+4722334455'),
+    ('0 22 33 44 55', '47', '', '+4722334455'),
+    # but not where it belongs to the number
+    ('0612345678', '+39', '', '+390612345678'),
+    # a trunk prefix
+    ('020 7946 0958', '+44', '', '+442079460958'),
+    ('7946 0958', '+44', '020', '+442079460958'),
+    ('(0)30 1234567', '+49', '', '+49301234567'),
+    ('011 44 20 7946 0958', '+1', '', '+442079460958'),
+    # impossible numbers
+    ('2233445566', '+47', '', None),
+    ('0223344556', '+47', '', None),
+    ('+999 1234', '+47', '', None),
+]
+
+
+def conversions():
+    """numbers are converted by the numbering plan of the country dialed from"""
+    for number, country_code, local_code, expected in CASES:
+        try:
+            converted = to_e164(number, country_code, local_code)
+        except ImpossibleNumber:
+            converted = None
+        assert converted == expected, f"{number!r} from {country_code}: {converted}"
+        assert to_e164_many([number], country_code, local_code) == [expected], number
+
+
+TESTS = [conversions]
+
+
+def main():
+    """runs the tests, returns the exit status"""
+    for test in TESTS:
+        try:
+            test()
+        except Exception as exc: # pylint: disable=broad-except
+            print(f"{test.__name__}: failed: {exc!r}")
+            return 1
+        print(f"{test.__name__:>14}: ok")
+    print("Tests completed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
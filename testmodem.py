@@ -1,6 +1,30 @@
-"""run som simple tests on modem simulator"""
+"""run some simple tests on modem simulator, and measure it
+
+    python testmodem.py                   a Modem over pseudo terminals (not Windows)
+    python testmodem.py --port COM3       a modem emulator already running on COM4
+    python testmodem.py --save-baseline   remember the numbers measured now
+
+Every scenario reports per-command round trip latency (p50/p99),
+commands/sec and bytes/sec. If a baseline was saved, a scenario that
+is slower than the baseline by more than --tolerance fails the run.
+"""
+import argparse
+import array
+import asyncio
+import json
+import os
+import select
+import sys
+import threading
+import time
+
 import serial
 
+from modem import Modem
+
+_TIMEOUT = 5    # seconds to wait for an expected reply
+_BASELINE = 'testmodem-baseline.json'
+
 
 def _bs(string):
     if isinstance(string, str):
@@ -13,15 +37,37 @@ def _s(string):
         return string.decode('cp437')
     return string
 
+
+class ExpectationFailed(AssertionError):
+    """The modem did not reply as expected"""
+
+
 class SerialTester:
-    """Helper class to test serial lines"""
+    """Helper class to test serial lines, and time the round trips"""
     def __init__(self, port):
         self._port = port
-        self._sendcount = 0
+        self._port.timeout = _TIMEOUT
+        self.commands = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = []     # seconds from each command sent to its last reply
+        self._sent_at = None
+        self._replied_at = None
+
+
+    def _command_done(self):
+        if self._sent_at is not None and self._replied_at is not None:
+            self.latencies.append(self._replied_at - self._sent_at)
+        self._sent_at = self._replied_at = None
 
 
-    def send(self, data):
-        self._port.write(_bs(data))
+    def send(self, data, commands=1):
+        self._command_done()
+        self.commands += commands
+        data = _bs(data)
+        self._sent_at = time.perf_counter()
+        self._port.write(data)
+        self.bytes_sent += len(data)
 
 
     def send_expect_echo(self, data):
@@ -42,75 +88,486 @@ class SerialTester:
         data = _bs(data)
         read = b''
         while len(read) < len(data) and data.startswith(read):
-            read += self._port.read(min(self._port.in_waiting or 1,
+            chunk = self._port.read(min(self._port.in_waiting or 1,
                                         len(data) - len(read)))
+            if chunk == b'':
+                break
+            read += chunk
+        self.bytes_received += len(read)
+        self._replied_at = time.perf_counter()
         if read != data:
-            print(f"Expectation failed:")
-            print(f"    Expected: {repr(data)}")
-            print(f"    Got     : {repr(read)}")
-
-
-port = serial.Serial(port='COM3', baudrate=9600, bytesize=8, stopbits=1)
-s = SerialTester(port)
-
-# pylint: disable=multiple-statements
-s.sendline_expect_echo('at'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('   at    '); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('')
-s.sendline_expect_echo('   ')
-s.sendline_expect_echo('\b')
-s.send('a'); s.expect('a')
-s.send('t'); s.expect('t')
-s.send('\r'); s.expect('\r\n')
-s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('xy\b\bat'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('\u0000\u0000'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atat'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('+++at'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('fn92fj9me2,['); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('ata0'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atb0'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atb1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atb2'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('ate0'); s.expect('\r\nOK\r\n')
-s.sendline('ate1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ate2'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('ath'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ath1'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atl'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atl0'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atl1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atl2'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atl3'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atl4'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atm0'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atm1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atm2'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atm3'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atm4'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('ato'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atq'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atq1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atq2'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('ats2=15'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('at?'); s.expect('\r\n15\r\n'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ats3=120'); s.expect('x\nOKx\n')
-s.send('ats3=13x'); s.expect('ats3=13x\n'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ats4=120?'); s.expect('\rx120\rx'); s.expect('\rxOK\rx')
-s.send('ats4=10\r'); s.expect('ats4=10\rx'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ats5=30=120?'); s.expect('\r\n120\r\n'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('##xxat'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ats5=8'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('ats99'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atdt99999'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atv0'); s.expect('0\r')
-s.sendline_expect_echo('atv1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atx0'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atx1'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atx2'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atx3'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atx4'); s.expect('\r\nOK\r\n')
-s.sendline_expect_echo('atx5'); s.expect('\r\nERROR\r\n')
-s.sendline_expect_echo('atz'); s.expect('\r\nOK\r\n')
-
-print("Tests completed")
+            raise ExpectationFailed(f"Expected: {data!r}, got: {read!r}")
+
+
+    def finish(self):
+        """ends the timing of the last command"""
+        self._command_done()
+
+
+class _PtyPort:
+    """The terminal end of a pseudo terminal, used like a serial port"""
+    def __init__(self, fd):
+        self._fd = fd
+        self.timeout = None
+
+    @property
+    def in_waiting(self):
+        """number of bytes ready to be read"""
+        # pylint: disable=import-outside-toplevel
+        import fcntl
+        import termios
+        count = array.array('i', [0])
+        fcntl.ioctl(self._fd, termios.FIONREAD, count, True)
+        return count[0]
+
+    def fileno(self):
+        """the file descriptor"""
+        return self._fd
+
+    def read(self, size=1):
+        """up to `size` bytes, or b'' after `timeout` seconds"""
+        ready, _, _ = select.select([self._fd], [], [], self.timeout)
+        return os.read(self._fd, size) if ready else b''
+
+    def write(self, data):
+        """write all of `data`"""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        return len(data)
+
+
+class QuietDialer:
+    """A dialer that does nothing"""
+    def dial(self, to_number): # pylint: disable=no-self-use,unused-argument
+        """do not dial"""
+
+
+class FailingDialer:
+    """A dialer that fails with `error`"""
+    def __init__(self, error):
+        self._error = error
+
+
+    def dial(self, to_number): # pylint: disable=unused-argument
+        """fail to dial"""
+        raise self._error
+
+
+class PtyModem:
+    """A Modem running in a thread of its own, at the other end of a
+    pseudo terminal from self.port. The modem is a `modem_class`, made with
+    `settings` as keyword arguments."""
+    def __init__(self, dialer=None, modem_class=Modem, **settings):
+        # pylint: disable=import-outside-toplevel
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        self._master = master
+        self._serial_port = serial.Serial(os.ttyname(slave))
+        os.close(slave)
+        self.modem = modem_class(self._serial_port, dialer or QuietDialer(), **settings)
+        self.port = _PtyPort(master)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='modem', daemon=True)
+        self._thread.start()
+
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.modem.run_once()
+
+
+    def close(self):
+        """stops the modem"""
+        self._stopped.set()
+        self._serial_port.cancel_read()
+        self._thread.join()
+        self._serial_port.close()
+        os.close(self._master)
+
+
+class AsyncPtyModem(PtyModem):
+    """An AsyncModem running in an event loop in a thread of its own, at the
+    other end of a pseudo terminal from self.port"""
+    def __init__(self, dialer=None, **settings):
+        # pylint: disable=import-outside-toplevel
+        from async_modem import AsyncModem
+        self.error = None       # what run() raised, if anything
+        self._loop = None
+        self._task = None
+        self._running = threading.Event()
+        super().__init__(dialer, AsyncModem, **settings)
+        self._running.wait()
+
+
+    def _run(self):
+        async def run():
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.current_task()
+            self._running.set()
+            await self.modem.run()
+        try:
+            asyncio.run(run())
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc: # pylint: disable=broad-except
+            self.error = exc
+        finally:
+            self._running.set()
+
+
+    def hang_up(self, timeout=_TIMEOUT):
+        """closes the terminal end, returns whether the modem stopped within
+        `timeout` seconds"""
+        os.close(self._master)
+        self._master = None
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+    def close(self):
+        """stops the modem"""
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join()
+        self._serial_port.close()
+        if self._master is not None:
+            os.close(self._master)
+
+
+def expectations(s):
+    """the expected behaviour of the modem"""
+    # pylint: disable=multiple-statements
+    s.sendline_expect_echo('at'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('   at    '); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('')
+    s.sendline_expect_echo('   ')
+    s.sendline_expect_echo('\b')
+    s.send('a'); s.expect('a')
+    s.send('t'); s.expect('t')
+    s.send('\r'); s.expect('\r\n')
+    s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('xy\b\bat'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('\u0000\u0000'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atat'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('+++at'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('fn92fj9me2,['); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('ata0'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atb0'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atb1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atb2'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('ate0'); s.expect('\r\nOK\r\n')
+    s.sendline('ate1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ate2'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('ath'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ath1'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atl'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atl0'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atl1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atl2'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atl3'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atl4'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atm0'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atm1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atm2'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atm3'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atm4'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('ato'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atq'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atq1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atq2'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('ats2=15'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('at?'); s.expect('\r\n15\r\n'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ats3=120'); s.expect('x\nOKx\n')
+    s.send('ats3=13x'); s.expect('ats3=13x\n'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ats4=120?'); s.expect('\rx120\rx'); s.expect('\rxOK\rx')
+    s.send('ats4=10\r'); s.expect('ats4=10\rx'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ats5=30=120?'); s.expect('\r\n120\r\n'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('##xxat'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ats5=8'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('ats99'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atdt99999'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atv0'); s.expect('0\r')
+    s.sendline_expect_echo('atv1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atx0'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atx1'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atx2'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atx3'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atx4'); s.expect('\r\nOK\r\n')
+    s.sendline_expect_echo('atx5'); s.expect('\r\nERROR\r\n')
+    s.sendline_expect_echo('atz'); s.expect('\r\nOK\r\n')
+
+
+def commands(s, count=2000):
+    """one short command at a time, like a dialing program"""
+    for _ in range(count):
+        s.sendline_expect_echo('at'); s.expect('\r\nOK\r\n') # pylint: disable=multiple-statements
+
+
+def init_strings(s, count=500):
+    """long init strings and dials, as sent by Safecon"""
+    # pylint: disable=multiple-statements
+    for _ in range(count):
+        s.sendline_expect_echo('ATE1V1Q0X4S0=0S7=60L0M0'); s.expect('\r\nOK\r\n')
+        s.sendline_expect_echo('ATDT 555 1234'); s.expect('\r\nOK\r\n')
+        s.sendline_expect_echo('ATH'); s.expect('\r\nOK\r\n')
+
+
+def pasted(s, count=500):
+    """many command lines sent at once (without echo, which is written
+    as it is read, not a line at a time)"""
+    # pylint: disable=multiple-statements
+    s.sendline_expect_echo('ate0'); s.expect('\r\nOK\r\n')
+    s.send(b'at\r' * count, commands=count); s.expect('\r\nOK\r\n' * count)
+    s.sendline('ate1'); s.expect('\r\nOK\r\n')
+
+
+def online(s, size=1 << 20):
+    """a host sending data while 'connected', then escaping with +++"""
+    # pylint: disable=multiple-statements
+    s.sendline_expect_echo('ats12=5'); s.expect('\r\nOK\r\n')     # 0.1 s guard time
+    s.sendline_expect_echo('ato999'); s.expect('\r\nCONNECT\r\n')
+    s.send(b'x' * size, commands=0)
+    time.sleep(0.15)
+    s.send('+++'); s.expect('\r\nNO CARRIER\r\n')
+    s.sendline_expect_echo('atz'); s.expect('\r\nOK\r\n')
+
+
+SCENARIOS = [expectations, commands, init_strings, pasted, online]
+
+
+def percentile(values, fraction):
+    """Returns the value `fraction` (0.99 for p99) of the way up the sorted
+    `values`, or nan if there are none"""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_scenario(scenario, port=None, pty_modem_class=PtyModem):
+    """runs `scenario` against the modem on `port`, or against a new
+    `pty_modem_class` over a pseudo terminal, returns its measurements"""
+    pty_modem = None
+    if port is None:
+        pty_modem = pty_modem_class()
+        port = pty_modem.port
+    try:
+        tester = SerialTester(port)
+        start = time.perf_counter()
+        scenario(tester)
+        tester.finish()
+        seconds = time.perf_counter() - start
+    finally:
+        if pty_modem is not None:
+            pty_modem.close()
+    return {'p50_ms': percentile(tester.latencies, 0.5) * 1000,
+            'p99_ms': percentile(tester.latencies, 0.99) * 1000,
+            'commands_per_sec': tester.commands / seconds,
+            'bytes_per_sec': (tester.bytes_sent + tester.bytes_received) / seconds}
+
+
+def check_async_modem():
+    """an AsyncModem behaves as expected, and stops when the other end hangs
+    up, also while online (where it reads the file descriptor itself); a
+    modem that fails doesn't stop the others run with it"""
+    run_scenario(expectations, pty_modem_class=AsyncPtyModem)
+    for online in (False, True):
+        pty_modem = AsyncPtyModem()
+        try:
+            if online:
+                tester = SerialTester(pty_modem.port)
+                tester.sendline_expect_echo('ato999')
+                tester.expect('\r\nCONNECT\r\n')
+            if not pty_modem.hang_up():
+                raise ExpectationFailed(f"AsyncModem still running after hangup (online={online})")
+            # a SerialException, or the OSError (EIO) it is a kind of
+            if not isinstance(pty_modem.error, OSError):
+                raise ExpectationFailed(f"AsyncModem stopped with {pty_modem.error!r} after hangup"
+                                        f" (online={online})")
+        finally:
+            pty_modem.close()
+    _check_run_modems()
+
+
+class _StubModem:
+    """Runs until stopped, or fails with `error` at once"""
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.stopped = None
+
+
+    async def run(self):
+        """fails, or waits until cancelled"""
+        if self.error is not None:
+            raise self.error
+        self.stopped = asyncio.Event()
+        await self.stopped.wait()
+
+
+def _check_run_modems():
+    # a modem that fails stops alone, the others keep running
+    # pylint: disable=import-outside-toplevel
+    import logging
+    from async_modem import run_modems
+
+    async def run():
+        failing = _StubModem('COM1', serial.SerialException('device disconnected'))
+        running = _StubModem('COM2')
+        task = asyncio.ensure_future(run_modems([failing, running]))
+        await asyncio.sleep(0.01)
+        if task.done():
+            raise ExpectationFailed(f"run_modems stopped when one modem failed: {task!r}")
+        running.stopped.set()
+        await asyncio.wait_for(task, 1)
+
+    logging.disable(logging.CRITICAL)
+    try:
+        asyncio.run(run())
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def check_failing_dialer():
+    """a dial that fails, however it does, is answered with ERROR, and the
+    modem keeps running"""
+    # pylint: disable=import-outside-toplevel,multiple-statements
+    import logging
+    logging.disable(logging.CRITICAL)
+    try:
+        for error in (ValueError('impossible number'), ConnectionError('refused'),
+                      TimeoutError('timed out'), RuntimeError('no success')):
+            pty_modem = PtyModem(FailingDialer(error), dial_result='inline')
+            try:
+                tester = SerialTester(pty_modem.port)
+                tester.sendline_expect_echo('atdt22334455'); tester.expect('\r\nERROR\r\n')
+                tester.sendline_expect_echo('at'); tester.expect('\r\nOK\r\n')
+            finally:
+                pty_modem.close()
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def traced_session(s, pause=0.05):
+    """a short session to record and replay: a few dials, and an escape,
+    with a `pause` between commands (a replay doesn't wait for replies)"""
+    # pylint: disable=multiple-statements
+    for line, reply in [('ATE1V1Q0X4S0=0S7=60L0M0', 'OK'), ('ATDT 555 1234', 'OK'),
+                        ('ATH', 'OK'), ('ats12=5', 'OK'), ('ato999', 'CONNECT')]:
+        s.sendline_expect_echo(line); s.expect(f'\r\n{reply}\r\n')
+        time.sleep(pause)
+    s.send(b'x' * 4096, commands=0)
+    time.sleep(0.15)
+    s.send('+++'); s.expect('\r\nNO CARRIER\r\n')
+    time.sleep(pause)
+    s.sendline_expect_echo('atz'); s.expect('\r\nOK\r\n')
+
+
+def check_session_trace():
+    """a recorded session replays to the same output, at 1x and faster"""
+    # pylint: disable=import-outside-toplevel
+    import tempfile
+    import session_trace
+    with tempfile.TemporaryDirectory() as temporary:
+        path = os.path.join(temporary, 'session.trace')
+        pty_modem = PtyModem(trace=path)
+        try:
+            traced_session(SerialTester(pty_modem.port))
+        finally:
+            pty_modem.close()
+            pty_modem.modem._trace.close() # pylint: disable=protected-access
+        for speed in (1, 10):
+            expected, actual, _ = session_trace.replay(path, speed, settle=0.5)
+            if actual != expected:
+                raise ExpectationFailed(f"replay at {speed}x: expected {expected!r},"
+                                        f" got {actual!r}")
+
+
+def regressions(results, baseline, tolerance):
+    """what got worse than `baseline` by more than `tolerance` (a fraction)"""
+    found = []
+    for name, measured in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ('commands_per_sec', 'bytes_per_sec'):
+            if measured[key] < before[key] * (1 - tolerance):
+                found.append(f"{name}: {key} {measured[key]:,.0f}, was {before[key]:,.0f}")
+        for key in ('p50_ms', 'p99_ms'):
+            if measured[key] > before[key] * (1 + tolerance):
+                found.append(f"{name}: {key} {measured[key]:.3f}, was {before[key]:.3f}")
+    return found
+
+
+def main():
+    """runs the tests, returns the exit status"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', help='serial port of a running modem emulator, '
+                                       'instead of one over a pseudo terminal')
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--baseline', default=_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='how much slower than the baseline is a failure (0.5 = 50%%)')
+    args = parser.parse_args()
+
+    port = None
+    scenarios = SCENARIOS
+    if args.port:
+        port = serial.Serial(port=args.port, baudrate=args.baudrate, bytesize=8, stopbits=1)
+        scenarios = [expectations]
+
+    results = {}
+    for scenario in scenarios:
+        try:
+            results[scenario.__name__] = measured = run_scenario(scenario, port)
+        except ExpectationFailed as exc:
+            print(f"{scenario.__name__}: expectation failed: {exc}")
+            return 1
+        print(f"{scenario.__name__:>14}: p50 {measured['p50_ms']:.3f} ms,"
+              f" p99 {measured['p99_ms']:.3f} ms,"
+              f" {measured['commands_per_sec']:,.0f} commands/s,"
+              f" {measured['bytes_per_sec']:,.0f} bytes/s")
+
+    if args.port:
+        print("Tests completed")
+        return 0
+    try:
+        check_async_modem()
+    except ExpectationFailed as exc:
+        print(f"async modem: expectation failed: {exc}")
+        return 1
+    print(f"{'async modem':>14}: ok")
+    try:
+        check_failing_dialer()
+    except ExpectationFailed as exc:
+        print(f"failing dialer: expectation failed: {exc}")
+        return 1
+    print(f"{'failing dialer':>14}: ok")
+    try:
+        check_session_trace()
+    except ExpectationFailed as exc:
+        print(f"session trace: expectation failed: {exc}")
+        return 1
+    print(f"{'session trace':>14}: ok")
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline saved in {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            found = regressions(results, json.load(baseline_file), args.tolerance)
+        if found:
+            print("Slower than the baseline:")
+            for regression in found:
+                print(f"    {regression}")
+            return 1
+    print("Tests completed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())